@@ -1,31 +1,192 @@
 from pathlib import Path
-import re, shutil
+import csv, errno, hashlib, os, pickle, re, shutil, sys
 import pandas as pd
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from utils import init_experiment_tree
 
+COPY_WORKERS = 16  # parallel file copies
+COPY_RANGE_CHUNK = 16 * 1024 * 1024  # bytes per copy_file_range call
+# copy_file_range errors meaning "not supported here" (fall back to sendfile); anything else is a real error
+COPY_RANGE_UNSUPPORTED = {errno.ENOSYS, errno.EXDEV, errno.EOPNOTSUPP, errno.EINVAL}
+MANIFEST_COLUMNS = ['time', 'source', 'destination', 'status', 'note']
+MAPPING_COLUMNS = {'experiment', 'old_name', 'new_name'}
+MAPPING_CACHE_DIR = Path.home() / '.cache' / 'o2n'  # parsed Excel mappings
+MAPPING_CACHE_VERSION = 2  # bump whenever load_mapping parses the workbook differently
+
+def _kernel_copy(fd_in, fd_out, size):
+    """Copy size bytes between file descriptors inside the kernel (Linux only)."""
+    offset = 0
+    if hasattr(os, 'copy_file_range'):
+        # copy_file_range lets the filesystem copy server-side / reflink; not every
+        # filesystem (or kernel) supports it, so fall back to sendfile from where it stopped
+        try:
+            while offset < size:
+                copied = os.copy_file_range(fd_in, fd_out, min(size - offset, COPY_RANGE_CHUNK),
+                                            offset, offset)
+                if copied == 0:
+                    break
+                offset += copied
+        except OSError as e:
+            if e.errno not in COPY_RANGE_UNSUPPORTED:
+                raise
+        # sendfile writes at fd_out's own position, which copy_file_range (explicit offsets) never moved
+        os.lseek(fd_out, offset, os.SEEK_SET)
+    while offset < size:
+        sent = os.sendfile(fd_out, fd_in, offset, size - offset)
+        if sent == 0:
+            break
+        offset += sent
+
+def _fast_copy(src, dst):
+    """Copy src to dst (overwritten if it exists) with its metadata, in the kernel on Linux."""
+    if not sys.platform.startswith('linux'):
+        shutil.copy2(src, dst)  # shutil's platform copy path (e.g. CopyFile2 on Windows)
+        return
+    with open(src, 'rb') as f_in, open(dst, 'wb') as f_out:
+        size = os.fstat(f_in.fileno()).st_size
+        try:  # let the kernel read ahead aggressively on the source
+            os.posix_fadvise(f_in.fileno(), 0, size, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+        _kernel_copy(f_in.fileno(), f_out.fileno(), size)
+    shutil.copystat(src, dst)
+
 def copy_file(src, dst):
-    """Copy file if destination doesn't exist."""
+    """Copy file if destination doesn't exist.
+
+    The data goes to dst + '.part' first and is renamed to dst only once the copy
+    has completed, so an interrupted run never leaves a truncated file under the
+    final name. src and dst are plain string paths; the destination folder must
+    already exist."""
+    if os.path.lexists(dst):
+        return 'SKIP', 'file exists'
+    part = dst + '.part'
     try:
-        if dst.exists():
-            return 'SKIP', 'file exists'
-        dst.parent.mkdir(parents=True, exist_ok=True)
-        shutil.copy2(src, dst.stem)
+        _fast_copy(src, part)
+        os.replace(part, dst)
         return 'COPIED', ''
     except Exception as e:
+        try:
+            os.remove(part)
+        except OSError:
+            pass
         return 'ERROR', str(e)
 
+FISH_DIR_RE = re.compile(r'^[fF]\d+')  # fish folders in an old experiment, e.g. 'f15'
+PLANE_DIR_RE = re.compile(r'plane\d+')  # suite2p plane folders
+FISH_ID_RE = re.compile(r'(?i)f?\d+')  # first fish id in a file name, e.g. 'f15' or '15'
+FISH_TRAIL_RE = re.compile(r'(\d+)$')  # trailing fish number of a folder/id, e.g. 'f015'
+
+def _rename_fish(file_name, new_name):
+    """Replace the first fish id in file_name with new_name."""
+    return FISH_ID_RE.sub(new_name, file_name, count=1)
+
 def _to_int_fish(s):
     """Extract trailing integer fish id (e.g. 'f015'->15)."""
-    m = re.search(r'(\d+)$', str(s))
+    m = FISH_TRAIL_RE.search(str(s))
     return int(m.group(1)) if m else None
 
-def get_new_name(df, experiment_root, old_name):
-    """Return the new name for a given old_name (like 'f15') in a given experiment."""
-    exp = Path(experiment_root).name
-    num = _to_int_fish(old_name)
-    match = df[(df['experiment'] == exp) & (df['old_name'] == num)]
-    return match['new_name'].iloc[0] if not match.empty else None
+def _scan_files(folder, contains, suffix):
+    """Files in folder named like the glob f'*{contains}*{suffix}' (one scandir, no fnmatch, no stat per file).
+
+    Matching is case-insensitive, like glob on Windows where the migration runs."""
+    contains, suffix = contains.lower(), suffix.lower()
+    with os.scandir(folder) as it:
+        return [e for e in it
+                if e.name.lower().endswith(suffix) and contains in e.name[:-len(suffix)].lower() and e.is_file()]
+
+def _mapping_cache_path(xlsx_path):
+    """Cache file for an Excel mapping, keyed by the workbook's path, mtime and size and the cache version."""
+    xlsx_path = Path(xlsx_path).resolve()
+    st = xlsx_path.stat()
+    key = hashlib.sha1(f"{MAPPING_CACHE_VERSION}_{xlsx_path}_{st.st_mtime_ns}_{st.st_size}".encode()).hexdigest()
+    return MAPPING_CACHE_DIR / f"{key}.pkl"
+
+def load_mapping(xlsx_path):
+    """Read the Excel mapping into {(experiment lowercased, old fish number): new_name}.
+
+    The parsed mapping is cached next to the user's home; the cache key changes
+    whenever the workbook is saved again, so edits are always picked up.
+    """
+    cache_path = _mapping_cache_path(xlsx_path)
+    try:
+        with open(cache_path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        pass
+    read_kwargs = dict(usecols=lambda c: c in MAPPING_COLUMNS, dtype={'experiment': str, 'new_name': str})
+    try:
+        df = pd.read_excel(xlsx_path, engine='calamine', **read_kwargs)  # needs pandas>=2.2 + python-calamine
+    except (ImportError, ValueError):
+        df = pd.read_excel(xlsx_path, **read_kwargs)
+    if not MAPPING_COLUMNS.issubset(df.columns):
+        raise RuntimeError(f"Excel must contain columns: {MAPPING_COLUMNS}")
+    mapping = {}
+    for exp, old, new in zip(df['experiment'].astype(str).str.lower(), df['old_name'], df['new_name']):
+        mapping.setdefault((exp, old), new)  # first row wins for duplicates
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(cache_path, 'wb') as f:
+            pickle.dump(mapping, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass  # cache is only a speed-up
+    return mapping
+
+def _iter_fish_copies(fish_dir, old_id, new_name, paths):
+    """Yield (source, destination) string paths for every file of one fish, stage by stage."""
+    # Stage folders of this fish, listed with one directory scan instead of a stat per stage
+    with os.scandir(fish_dir) as it:
+        stage_dirs = {e.name: Path(e.path) for e in it if e.is_dir()}
+
+    # ----- 00_raw -----
+    raw_dir = stage_dirs.get('00_raw')
+    if raw_dir:
+        raw_anat_dst = str(paths['raw_2p_anatomy'])
+        raw_func_dst = str(paths['raw_2p_functional'])
+        for e in _scan_files(raw_dir, f'{old_id}', '.tif'):
+            is_anat = '_anatomy_' in e.name.lower()
+            dst_dir = raw_anat_dst if is_anat else raw_func_dst
+            yield e.path, os.path.join(dst_dir, _rename_fish(e.name, new_name))
+
+    # ----- 01_metadata -----
+    meta_dir = stage_dirs.get('01_metadata')
+    if meta_dir:
+        meta_dst = str(paths['raw_2p_metadata'])
+        for e in _scan_files(meta_dir, f'_{old_id}_', '.csv'):
+            yield e.path, os.path.join(meta_dst, _rename_fish(e.name, new_name))
+
+    # ----- 02_preprocessed -----
+    preproc_dir = stage_dirs.get('02_preprocessed')
+    if preproc_dir:
+        preproc_dst = str(paths['preproc_individual_planes'])
+        for e in _scan_files(preproc_dir, f'{old_id}_plane', '.tif'):
+            yield e.path, os.path.join(preproc_dst, _rename_fish(e.name, new_name))
+
+    # ----- 03_motion_corrected -----
+    mcorr_dir = stage_dirs.get('03_motion_corrected')
+    if mcorr_dir:
+        mcorr_dst = str(paths['preproc_motion_corrected'])
+        for e in _scan_files(mcorr_dir, f'{old_id}_plane', '_mcorrected.tif'):
+            yield e.path, os.path.join(mcorr_dst, _rename_fish(e.name, new_name))
+
+    # ----- 04_segmented -----
+    s2p_dir = stage_dirs.get('04_segmented')
+    if s2p_dir:
+        s2p_dst = str(paths['analysis_suite2p'])
+        # One scandir per folder; DirEntry type checks reuse the listing, no extra stats
+        with os.scandir(s2p_dir) as it:
+            plane_entries = [e for e in it if e.is_dir() and PLANE_DIR_RE.match(e.name)]
+        for plane_entry in plane_entries:
+            new_plane_dir = os.path.join(s2p_dst, plane_entry.name)
+            with os.scandir(plane_entry.path) as it:
+                npy_entries = [e for e in it if e.name.lower().endswith('.npy') and e.is_file()]
+            if npy_entries:
+                # Plane folders are not part of the experiment tree: create each one once here
+                os.makedirs(new_plane_dir, exist_ok=True)
+            for e in npy_entries:
+                new_file = f"{new_name}_{plane_entry.name}_{e.name}"
+                yield e.path, os.path.join(new_plane_dir, new_file)
 
 def migrate_files(experiment_root, base_dir, xlsx_path, fish_list=None):
     """Copy data using mappings (experiment, old_name -> new_name) from Excel."""
@@ -33,99 +194,55 @@ def migrate_files(experiment_root, base_dir, xlsx_path, fish_list=None):
     base_dir = Path(base_dir)
 
     # Load Excel
-    df = pd.read_excel(xlsx_path)
-    needed_cols = {'experiment', 'old_name', 'new_name'}
-    if not needed_cols.issubset(df.columns):
-        raise RuntimeError(f"Excel must contain columns: {needed_cols}")
+    mapping = load_mapping(xlsx_path)
 
     exp_name = experiment_root.name
-    all_fish_dirs = [p for p in experiment_root.iterdir()
-                     if p.is_dir() and re.match(r'^[fF]\d+', p.name)]
+    exp_lc = exp_name.lower()  # mapping keys are lowercased once at load time
+    with os.scandir(experiment_root) as it:  # DirEntry.is_dir() reuses the listing, no stat per entry
+        all_fish_dirs = [Path(e.path) for e in it if e.is_dir() and FISH_DIR_RE.match(e.name)]
 
-    # Determine fish to process
+    # Determine fish to process (requested ids parsed once, not per folder)
     if fish_list is None:
         fish_dirs = all_fish_dirs
     else:
-        fish_dirs = [p for p in all_fish_dirs
-                     if _to_int_fish(p.name) in {_to_int_fish(f) for f in fish_list}]
-
-    for fish_dir in fish_dirs:
-        old_name = fish_dir.name
-        new_name = get_new_name(df, experiment_root, old_name)
-        if not new_name:
-            print(f"Skipping {old_name} — no mapping found in Excel")
-            continue
-
-        print(f"\nProcessing {old_name} → {new_name}")
-        paths = init_experiment_tree(base_dir, new_name)
-        results = []
-
-        old_id = _to_int_fish(old_name)
-
-        # ----- 00_raw -----
-        raw_dir = fish_dir / '00_raw'
-        if raw_dir.exists():
-            for f in raw_dir.glob(f'*{old_id}*.tif'):
-                is_anat = '_anatomy_' in f.name.lower()
-                dst_dir = paths['raw_2p_anatomy'] if is_anat else paths['raw_2p_functional']
-                dst = dst_dir / re.sub(r'(?i)f?\d+', new_name, f.name, count=1)
-                status, note = copy_file(f, dst)
-                print(f"Copied {f.name} to {dst} — {status}")  
-                results.append({'time': datetime.now(), 'source': str(f),
-                                'destination': str(dst), 'status': status, 'note': note})
-
-        # ----- 01_metadata -----
-        meta_dir = fish_dir / '01_metadata'
-        if meta_dir.exists():
-            for f in meta_dir.glob(f'*_{old_id}_*.csv'):
-                dst = paths['raw_2p_metadata'] / re.sub(r'(?i)f?\d+', new_name, f.name, count=1)
-                status, note = copy_file(f, dst)
-                print(f"Copied {f.name} to {dst} — {status}")
-                results.append({'time': datetime.now(), 'source': str(f),
-                                'destination': str(dst), 'status': status, 'note': note})
-
-        # ----- 02_preprocessed -----
-        preproc_dir = fish_dir / '02_preprocessed'
-        if preproc_dir.exists():
-            preproc_dst = paths['root'] / '02_reg/00_preprocessing/2p_functional/01_individualPlanes'
-            for f in preproc_dir.glob(f'*{old_id}_plane*.tif'):
-                dst = preproc_dst / re.sub(r'(?i)f?\d+', new_name, f.name, count=1)
-                status, note = copy_file(f, dst)
-                print(f"Copied {f.name} to {dst} — {status}")
-                results.append({'time': datetime.now(), 'source': str(f),
-                                'destination': str(dst), 'status': status, 'note': note})
-
-        # ----- 03_motion_corrected -----
-        mcorr_dir = fish_dir / '03_motion_corrected'
-        if mcorr_dir.exists():
-            mcorr_dst = paths['root'] / '02_reg/00_preprocessing/2p_functional/02_motionCorrected'
-            for f in mcorr_dir.glob(f'*{old_id}_plane*_mcorrected.tif'):
-                dst = mcorr_dst / re.sub(r'(?i)f?\d+', new_name, f.name, count=1)
-                status, note = copy_file(f, dst)
-                print(f"Copied {f.name} to {dst} — {status}")
-                results.append({'time': datetime.now(), 'source': str(f),
-                                'destination': str(dst), 'status': status, 'note': note})
-
-        # ----- 04_segmented -----
-        s2p_dir = fish_dir / '04_segmented'
-        if s2p_dir.exists():
-            s2p_dst = paths['root'] / '03_analysis/functional/suite2P'
-            for plane_dir in s2p_dir.iterdir():
-                if plane_dir.is_dir() and re.match(r'plane\d+', plane_dir.name):
-                    new_plane_dir = s2p_dst / plane_dir.name
-                    for file in plane_dir.glob('*.npy'):
-                        new_file = f"{new_name}_{plane_dir.name}_{file.name}"
-                        dst = new_plane_dir / new_file
-                        status, note = copy_file(file, dst)
-                        print(f"Copied {file.name} to {dst} — {status}")
-                        results.append({'time': datetime.now(), 'source': str(file),
-                                        'destination': str(dst), 'status': status, 'note': note})
-
-        # ----- Save manifest -----
-        if results:
-            now = datetime.now().strftime('%Y%m%d_%H%M')
-            pd.DataFrame(results).to_csv(experiment_root / '{now}_migration_manifest.csv', index=False)
-            print(f"Manifest saved for {new_name}")
+        wanted_ids = {_to_int_fish(f) for f in fish_list}
+        fish_dirs = [p for p in all_fish_dirs if _to_int_fish(p.name) in wanted_ids]
+
+    # ----- Copy (I/O bound: one pool of threads for the files of all fish) -----
+    # Copies are submitted as the stage folders are scanned, so copying starts with
+    # the first file found instead of after the whole experiment has been listed.
+    with ThreadPoolExecutor(max_workers=COPY_WORKERS) as pool:
+        futures = {}
+        for fish_dir in fish_dirs:
+            old_name = fish_dir.name
+            old_id = _to_int_fish(old_name)
+            new_name = mapping.get((exp_lc, old_id))
+            if not new_name:
+                print(f"Skipping {old_name} — no mapping found in Excel")
+                continue
+
+            print(f"\nProcessing {old_name} → {new_name}")
+            paths = init_experiment_tree(base_dir, new_name)
+            for src, dst in _iter_fish_copies(fish_dir, old_id, new_name, paths):
+                futures[pool.submit(copy_file, src, dst)] = (src, dst)
+
+        if not futures:
+            return
+
+        # Manifest rows are streamed to disk as copies finish, so an interrupted run
+        # still records everything that was done up to that point.
+        started = datetime.now()  # one timestamp for the run, used in the file name and every row
+        batch_ts = started.isoformat(timespec='seconds')
+        manifest_path = experiment_root / f"{started.strftime('%Y%m%d_%H%M')}_migration_manifest.csv"
+        with open(manifest_path, 'w', newline='') as manifest_file:
+            manifest = csv.writer(manifest_file)
+            manifest.writerow(MANIFEST_COLUMNS)
+            for future in as_completed(futures):
+                src, dst = futures[future]
+                status, note = future.result()
+                print(f"Copied {os.path.basename(src)} to {dst} — {status}")
+                manifest.writerow((batch_ts, src, dst, status, note))  # MANIFEST_COLUMNS order
+    print(f"Manifest saved to {manifest_path}")
 
 if __name__ == "__main__":
     xlsx_path = Path(r"oldnames_to_new.xlsx")
@@ -1,20 +1,29 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import pandas as pd
 from pathlib import Path
 from scipy.ndimage import uniform_filter1d
 import time
 
 
-def load_fluorescence_data(path):
+def load_fluorescence_data(path, roi_mask=None):
     """
     Load raw fluorescence time-series data from Suite2p output.
 
     Parameters:
     - path (Path): Path to F.npy file.
+    - roi_mask (np.ndarray): Optional boolean mask of ROIs to load; only those rows are read from disk.
 
     Returns:
-    - np.ndarray: Fluorescence trace data (T x N).
+    - np.ndarray: Fluorescence trace data (T x N), float32.
     """
-    fluorescence_trace = np.load(path).T
+    if roi_mask is None:
+        fluorescence = np.load(path)
+    else:
+        # F.npy is (N x T): memory-map it and copy only the selected ROI rows
+        fluorescence = np.load(path, mmap_mode='r')[roi_mask]
+    fluorescence_trace = fluorescence.T.astype(np.float32, copy=False)
     return fluorescence_trace
 
 def filter_dim_rois(fluorescence_trace, threshold_std=2):
@@ -29,14 +38,22 @@ def filter_dim_rois(fluorescence_trace, threshold_std=2):
     - np.ndarray: Filtered fluorescence trace (T x N_filtered).
     - np.ndarray: Boolean mask indicating retained ROIs.
     """
-    mean_fluo = np.mean(fluorescence_trace, axis=0)
-    mu, sigma = np.mean(mean_fluo), np.std(mean_fluo)
+    mean_fluo = fluorescence_trace.mean(axis=0, dtype=np.float32)
+    mu, sigma = mean_fluo.mean(), mean_fluo.std()
     bright_rois_mask = mean_fluo >= mu - threshold_std * sigma
-    return fluorescence_trace[:, bright_rois_mask], bright_rois_mask
+    if bright_rois_mask.all():
+        return fluorescence_trace, bright_rois_mask  # nothing to drop, no copy
+    return np.compress(bright_rois_mask, fluorescence_trace, axis=1), bright_rois_mask
+
+def _rolling_percentile(trace_block, window_frames, percentile):
+    """Centered sliding percentile (window 2*window_frames+1, clipped at the edges) of each column."""
+    return pd.DataFrame(trace_block).rolling(
+        window=2 * window_frames + 1, center=True, min_periods=1
+    ).quantile(percentile / 100.0).to_numpy(dtype=trace_block.dtype)
 
 def compute_percentile_baseline(fluorescence_trace, fps, tau,
                                         percentile=8, instability_ratio=0.1,
-                                        min_window_s=15, window_tau_multiplier=40):
+                                        min_window_s=15, window_tau_multiplier=40, n_workers=None):
     """
     Compute smooth F0_baseline (F0) using sliding percentile window and stability filtering.
 
@@ -48,32 +65,30 @@ def compute_percentile_baseline(fluorescence_trace, fps, tau,
     - instability_ratio (float): If F0 drops more than this ratio, ROI is unstable.
     - min_window_s (float): Minimum window size (seconds).
     - window_tau_multiplier (float): Multiplier of tau to compute window size.
+    - n_workers (int): Threads used for the sliding percentile (default: one per CPU, at most N).
 
     Returns:
-    - np.ndarray: Baseline matrix F0 (T x N), NaN for unstable ROIs.
+    - np.ndarray: Baseline matrix F0 (T x N, dtype of the trace), NaN for unstable ROIs.
     """
-    T, N = fluorescence_trace.shape
     window_s = max(min_window_s, window_tau_multiplier * tau)
     window_frames = int(window_s * fps)
 
-    F0_baseline = np.full_like(fluorescence_trace, np.nan)
-
-    for n in range(N):
-        trace = fluorescence_trace[:, n]
-        local_baseline  = np.zeros_like(trace)
-
-        # Sliding window percentile calculation
-        for t in range(T):
-            start = max(0, t - window_frames)
-            end = min(T, t + window_frames + 1)
-            local_baseline [t] = np.percentile(trace[start:end], percentile)
+    # Sliding window percentile over [t - window_frames, t + window_frames] (clipped at the
+    # edges); blocks of ROIs are processed in parallel threads (the rolling kernel releases the GIL)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_workers = max(1, min(n_workers, fluorescence_trace.shape[1]))
+    blocks = np.array_split(fluorescence_trace, n_workers, axis=1)
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        local_baseline = np.hstack(list(pool.map(
+            lambda block: _rolling_percentile(block, window_frames, percentile), blocks)))
 
-        # Stability check: discard ROIs with large F0_baseline fluctuations
-        if np.min(local_baseline ) < instability_ratio * np.max(local_baseline ):
-            continue
+    # Stability check: discard ROIs with large F0_baseline fluctuations
+    unstable = np.min(local_baseline, axis=0) < instability_ratio * np.max(local_baseline, axis=0)
 
-        # Smooth F0_baseline
-        F0_baseline[:, n] = uniform_filter1d(local_baseline , size=window_frames)
+    # Smooth F0_baseline
+    F0_baseline = uniform_filter1d(local_baseline, size=window_frames, axis=0, output=local_baseline.dtype)
+    F0_baseline[:, unstable] = np.nan
 
     return F0_baseline
 
@@ -88,8 +103,14 @@ def compute_dff(fluorescence_trace, F0_baseline):
     Returns:
     - np.ndarray: ΔF/F0 traces (T x N).
     """
-    baseline_safe = np.where(F0_baseline == 0, np.finfo(float).eps, F0_baseline)
-    return (fluorescence_trace - F0_baseline) / baseline_safe
+    # Computed in one output array; zero baselines are divided by eps instead
+    # (same result as dividing by a copy of F0 with zeros replaced by eps)
+    deltaF_F = np.subtract(fluorescence_trace, F0_baseline)
+    nonzero = F0_baseline != 0
+    np.divide(deltaF_F, F0_baseline, out=deltaF_F, where=nonzero)
+    if not nonzero.all():
+        deltaF_F[~nonzero] /= np.finfo(float).eps
+    return deltaF_F
 
 
 def process_suite2p_fluorescence(fish, s2p_folder, fps, tau, percentile=8, instability_ratio=0.1, min_window_s=15, window_tau_multiplier=40):
@@ -108,11 +129,10 @@ def process_suite2p_fluorescence(fish, s2p_folder, fps, tau, percentile=8, insta
     - np.ndarray: ΔF/F0 traces (T x N_final).
     - np.ndarray: Retained ROI indices relative to full Suite2p ROI list.
     """
-    fluorescence_trace = load_fluorescence_data(s2p_folder / f"{fish}_F.npy")
     iscell_mask = np.load(s2p_folder / f"{fish}_iscell.npy")[:, 0].astype(bool)
 
-    # Keep only ROIs classified as cells
-    fluorescence_trace = fluorescence_trace[:, iscell_mask]
+    # Keep only ROIs classified as cells (non-cell ROIs are never read)
+    fluorescence_trace = load_fluorescence_data(s2p_folder / f"{fish}_F.npy", iscell_mask)
     print(f"Excluded {np.sum(~iscell_mask)} non-cell ROIs. Remaining: {fluorescence_trace.shape[1]} cells.")
 
     # Remove dim (low-intensity) ROIs
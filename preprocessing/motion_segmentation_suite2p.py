@@ -1,16 +1,26 @@
 import suite2p
 from pathlib import Path
 import numpy as np
+import json
+import os
 import shutil
 import time
-import copy
 import re
 import gc
 import tifffile as tf
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl  # reflink copies (Linux only)
+except ImportError:
+    fcntl = None
+
+FILE_INDEX_RE = re.compile(r"file(\d+)")  # suite2p reg_tif chunk names
+FICLONE = 0x40049409  # ioctl request from linux/fs.h
 
 def get_file_index(path: Path) -> int:
     """Extract numeric index from filenames like 'file005000_chan0.tif'."""
-    match = re.search(r"file(\d+)", path.name)
+    match = FILE_INDEX_RE.search(path.name)
     if match:
         return int(match.group(1))
     return -1  # fallback if pattern not found
@@ -27,7 +37,10 @@ def join_reg_tiffs_to_one(reg_folder: Path, out_tiff: Path):
     - reg_folder (Path): Folder with Suite2p `reg_tif` chunks
     - out_tiff (Path): Output path for the merged TIFF stack
     """
-    tiff_files = sorted(reg_folder.glob("file*_chan0.tif"), key=get_file_index)
+    with os.scandir(reg_folder) as it:  # one listing, no fnmatch/stat per file
+        tiff_files = sorted((Path(e.path) for e in it
+                             if e.name.startswith("file") and e.name.endswith("_chan0.tif") and e.is_file()),
+                            key=get_file_index)
 
     # Ensure the destination directory exists (create parents as needed)
     out_tiff.parent.mkdir(parents=True, exist_ok=True)
@@ -36,16 +49,57 @@ def join_reg_tiffs_to_one(reg_folder: Path, out_tiff: Path):
     if out_tiff.exists():
         out_tiff.unlink()
 
-    # Open a writer for the output stack; BigTIFF handles >4 GB files safely
-    with tf.TiffWriter(out_tiff, bigtiff=True) as tw:
-        for f in tiff_files:
-            with tf.TiffFile(f) as tif:
-                for page in tif.pages:
-                    tw.write(page.asarray(), contiguous=True)
+    # Frame count and page shape of every chunk, from the TIFF headers only
+    chunk_shapes = []
+    for f in tiff_files:
+        with tf.TiffFile(f) as tif:
+            series = tif.series[0]
+            chunk_shapes.append((int(np.prod(series.shape[:-2])), series.shape[-2:], series.dtype))
+    if not chunk_shapes:
+        print(f"⚠️ No registered chunks in {reg_folder}")
+        return
+    frame_shape, dtype = chunk_shapes[0][1], chunk_shapes[0][2]
+    n_total = sum(n for n, _, _ in chunk_shapes)
+
+    # Create the output as one contiguous, memory-mapped BigTIFF (handles >4 GB files safely)
+    # and copy each chunk into its slice; uncompressed chunks are memory-mapped as well, so
+    # frames go from page cache to page cache without per-page decoding.
+    joined = tf.memmap(out_tiff, shape=(n_total, *frame_shape), dtype=dtype, bigtiff=True,
+                       photometric='minisblack')
+    start = 0
+    for f, (n, _, _) in zip(tiff_files, chunk_shapes):
+        try:
+            chunk = tf.memmap(f, mode='r')
+        except ValueError:  # compressed or not contiguous: decode straight into the output
+            tf.imread(f, out=joined[start:start + n])
+        else:
+            joined[start:start + n] = chunk.reshape(n, *frame_shape)
+            del chunk
+        start += n
+    joined.flush()
+    del joined
 
     print(f"✅ Wrote joined stack: {out_tiff}")
 
-def move_processed_files(plane_idx, analysis_s2p_folder, mcorrected_folder, fish_id):
+def fast_move(src, dst):
+    """
+    Move src to dst, replacing dst if it exists.
+
+    On the same filesystem this is a single rename; across filesystems
+    (os.replace raises OSError) it falls back to shutil.move (copy + delete).
+
+    Parameters:
+    - src (Path): File to move
+    - dst (Path): Destination file path
+    """
+    try:
+        os.replace(src, dst)
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        shutil.move(str(src), str(dst))
+
+def move_processed_files(plane_idx, analysis_s2p_folder, mcorrected_folder, fish_id, save_path0=None):
     """
     Move Suite2p outputs into organized folders:
     - Move registered TIFF chunks into the motion-corrected folder
@@ -55,10 +109,14 @@ def move_processed_files(plane_idx, analysis_s2p_folder, mcorrected_folder, fish
     - plane_idx (int): Plane index currently processed
     - analysis_s2p_folder (Path): Suite2p output base folder
     - mcorrected_folder (Path): Destination folder for motion-corrected TIFF files
+    - save_path0 (Path or None): Folder Suite2p wrote into (default: analysis_s2p_folder);
+      removed after the move if it is a separate per-plane folder
     """
+    if save_path0 is None:
+        save_path0 = analysis_s2p_folder
 
     # Path to the reg folder with TIFF files
-    reg_folder = analysis_s2p_folder / f"suite2p/plane0/reg_tif"
+    reg_folder = save_path0 / f"suite2p/plane0/reg_tif"
 
     if not reg_folder.exists():
         print(f"⚠️ Registered folder not found for plane {plane_idx} in {reg_folder}")
@@ -69,24 +127,38 @@ def move_processed_files(plane_idx, analysis_s2p_folder, mcorrected_folder, fish
     join_reg_tiffs_to_one(reg_folder, out_tiff)
 
     # Move segmentation .npy files
-    s2p_folder = analysis_s2p_folder / "suite2p/plane0"
+    s2p_folder = save_path0 / "suite2p/plane0"
     destination = analysis_s2p_folder / f"plane{plane_idx}"
     destination.mkdir(exist_ok=True)
 
     for seg_file in sorted(s2p_folder.glob('*.npy')):
         new_name = f"{fish_id}_plane{plane_idx}_{seg_file.name}"
         dest_file = destination / new_name
-        if dest_file.exists():
-            dest_file.unlink()
-        shutil.move(str(seg_file), str(dest_file))
+        fast_move(seg_file, dest_file)
         print(f"✅ Moved {seg_file.name} → {dest_file}")
 
     # Clean up Suite2p temporary folder
-    shutil.rmtree(analysis_s2p_folder / "suite2p")
+    shutil.rmtree(save_path0 / "suite2p")
+    if save_path0 != analysis_s2p_folder:
+        save_path0.rmdir()
 
     return destination
 
-def run_suite2p(plane_file, global_ops, save_path0, fps, fast_disk=None):
+def count_frames(tiff_path):
+    """
+    Number of frames in a TIFF stack, from the series shape in its header
+    (no per-page parsing for stacks written by tifffile).
+
+    Parameters:
+    - tiff_path (Path): TIFF stack
+
+    Returns:
+    - int: Number of frames
+    """
+    with tf.TiffFile(tiff_path) as tif:
+        return int(np.prod(tif.series[0].shape[:-2]))
+
+def run_suite2p(plane_file, global_ops, save_path0, fps, fast_disk=None, n_frames=None):
     """
     Prepare and run Suite2p segmentation on a single TIFF file.
 
@@ -96,8 +168,11 @@ def run_suite2p(plane_file, global_ops, save_path0, fps, fast_disk=None):
     - segmented_folder (Path): Destination for Suite2p output
     - fps (float) : framerate
     - fast_disk (str or Path or None): Optional fast disk path for Suite2p temporary files
+    - n_frames (int or None): Frames in plane_file if already known (read from the TIFF header otherwise)
     """
-    ops = copy.deepcopy(global_ops)
+    # Shallow copy: only top-level keys are replaced below (lists are new objects), so the
+    # shared global_ops is never mutated and its arrays need not be duplicated per plane
+    ops = dict(global_ops)
     ops['input_format'] = 'tif'
     ops['fs'] = fps
     ops['tiff_list'] = [plane_file]
@@ -109,12 +184,46 @@ def run_suite2p(plane_file, global_ops, save_path0, fps, fast_disk=None):
     if fast_disk is not None:
         ops['fast_disk'] = str(fast_disk)
 
-    ops['batch_size'] = 500 #if n_frames > 500 else n_frames
+    if n_frames is None:
+        n_frames = count_frames(plane_file)
+    ops['batch_size'] = min(500, n_frames)
 
     suite2p.run_s2p(ops=ops)
     gc.collect()
 
 
+def mirror_file(src, dst):
+    """
+    Mirror one file to dst (replacing it), as cheaply as the filesystems allow.
+
+    - Hardlink when src and dst are on the same filesystem (no data copied)
+    - Reflink (FICLONE, Btrfs/XFS) where supported
+    - Otherwise a regular copy with metadata (shutil.copy2)
+
+    Parameters:
+    - src (Path): File to mirror
+    - dst (Path): Destination file path
+    """
+    try:
+        os.remove(dst)
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+    if fcntl is not None:
+        try:
+            with open(src, 'rb') as f_in, open(dst, 'wb') as f_out:
+                fcntl.ioctl(f_out.fileno(), FICLONE, f_in.fileno())
+            shutil.copystat(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copy2(str(src), str(dst))
+
+
 def find_plane_file(pre_dir, plane_idx):
     """
     Find the preprocessed TIFF file for a specific plane index.
@@ -126,7 +235,9 @@ def find_plane_file(pre_dir, plane_idx):
     Returns:
     - Path or None: Path to matching TIFF file, or None if not found
     """
-    candidates = list(pre_dir.glob(f"*plane{plane_idx}.tif"))
+    suffix = f"plane{plane_idx}.tif"
+    with os.scandir(pre_dir) as it:  # one listing, entry types come with it (no stat per file)
+        candidates = [Path(e.path) for e in it if e.name.endswith(suffix) and e.is_file()]
     if len(candidates) == 0:
         return None
     elif len(candidates) > 1:
@@ -160,30 +271,64 @@ def process_fish(fish_folder, global_ops, selected_planes, fps, fast_disk=None,
 
     print(f"Created folders: {mcorrected_folder}, {analysis_s2p_folder}")
 
-    for plane_idx in selected_planes:
-        # Look for TIFF file corresponding to current plane
-        plane_file = find_plane_file(pre_dir, plane_idx)
-        if plane_file is None:
-            print(f"⚠️ Plane {plane_idx} not found.")
-            continue
-        print(f"Processing plane {plane_idx} → {plane_file.name}")
-        run_suite2p(plane_file, global_ops, analysis_s2p_folder, fps, fast_disk)
-        src_folder = move_processed_files(plane_idx, analysis_s2p_folder, mcorrected_folder, fish_folder.name)
-        
-        if storage_root is not None and src_folder:
-            storage_root_p = Path(storage_root)
-            storage_fish_base = storage_root_p / fish_folder.name
-
-            rel_folder = src_folder.relative_to(fish_folder)
-            dst_folder = storage_fish_base / rel_folder
-            dst_folder.mkdir(parents=True, exist_ok=True)
-            for f in src_folder.iterdir():
-                if f.is_file():
-                    dst_file = dst_folder / f.name
-                    shutil.copy2(str(f), str(dst_file))
-                    print(f"📁 Mirrored segmentation file: {f} → {dst_file}")
-        
-        gc.collect()
+    # Frame counts of the plane files, as recorded by the preprocessing step (if available)
+    plane_n_frames = []
+    metadata_file = pre_dir / f"{fish_folder.name}_preprocessing_metadata.json"
+    if metadata_file.exists():
+        with open(metadata_file) as f:
+            plane_n_frames = json.load(f).get("plane_n_frames", [])
+
+    # Suite2p (compute bound) runs on one plane while a background thread joins, moves and
+    # mirrors the outputs of the previous plane (I/O bound). Each plane gets its own Suite2p
+    # output folder so the two never touch the same files.
+    with ThreadPoolExecutor(max_workers=1) as post_processing:
+        pending = None
+        for plane_idx in selected_planes:
+            # Look for TIFF file corresponding to current plane
+            plane_file = find_plane_file(pre_dir, plane_idx)
+            if plane_file is None:
+                print(f"⚠️ Plane {plane_idx} not found.")
+                continue
+            print(f"Processing plane {plane_idx} → {plane_file.name}")
+            save_path0 = analysis_s2p_folder / f"_suite2p_run_plane{plane_idx}"
+            n_frames = plane_n_frames[plane_idx] if plane_idx < len(plane_n_frames) else None
+            run_suite2p(plane_file, global_ops, save_path0, fps, fast_disk, n_frames)
+            if pending is not None:
+                pending.result()  # re-raises errors of the previous plane
+            pending = post_processing.submit(finish_plane, plane_idx, fish_folder, analysis_s2p_folder,
+                                             mcorrected_folder, save_path0, storage_root)
+            gc.collect()
+        if pending is not None:
+            pending.result()
+
+
+def finish_plane(plane_idx, fish_folder, analysis_s2p_folder, mcorrected_folder, save_path0, storage_root=None):
+    """
+    Move the Suite2p outputs of one plane into place and mirror them to storage_root.
+
+    Parameters:
+    - plane_idx (int): Plane index that was processed
+    - fish_folder (Path): Folder of the fish (base directory)
+    - analysis_s2p_folder (Path): Suite2p output base folder
+    - mcorrected_folder (Path): Destination folder for motion-corrected TIFF files
+    - save_path0 (Path): Folder Suite2p wrote this plane into
+    - storage_root (str or Path or None): Optional root path where final outputs will be copied (mirror)
+    """
+    src_folder = move_processed_files(plane_idx, analysis_s2p_folder, mcorrected_folder, fish_folder.name,
+                                      save_path0)
+
+    if storage_root is not None and src_folder:
+        storage_root_p = Path(storage_root)
+        storage_fish_base = storage_root_p / fish_folder.name
+
+        rel_folder = src_folder.relative_to(fish_folder)
+        dst_folder = storage_fish_base / rel_folder
+        dst_folder.mkdir(parents=True, exist_ok=True)
+        for f in src_folder.iterdir():
+            if f.is_file():
+                dst_file = dst_folder / f.name
+                mirror_file(f, dst_file)
+                print(f"📁 Mirrored segmentation file: {f} → {dst_file}")
 
 
 def batch_process(data_root, ops_path, fps, fish_ids=None, selected_planes=None, fast_disk=None):
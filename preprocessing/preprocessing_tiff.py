@@ -5,23 +5,41 @@ import json
 import time
 import gc
 import re
-import multiprocessing as mp
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-def correct_chunk_int16_to_uint16(chunk, offset):
+MAX_FISH_WORKERS = 4  # fish preprocessed in parallel (I/O bound: more workers thrash the disk)
+BLOCK_READ_WORKERS = 4  # raw TIFF blocks of one fish read concurrently
+DECODE_WORKERS = 4  # threads decoding the pages of one compressed raw TIFF
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024  # bytes buffered per output TIFF before each write() call
+
+
+def correct_chunk_int16_to_uint16(chunk, offset, out=None):
     """
     Correct one chunk of frames by shifting negative values to positive.
 
     Parameters:
     - chunk (np.ndarray): 3D array chunk.
     - offset (int): Value to add to make data positive.
+    - out (np.ndarray or None): uint16 array to write the result into (allocated if None).
 
     Returns:
     - np.ndarray: Corrected uint16 chunk.
     """
-    chunk_int32 = chunk.astype(np.int32)
-    chunk_int32 += offset
+    if out is None:
+        out = np.empty(chunk.shape, dtype=np.uint16)
+
+    if chunk.dtype == np.int16 and 0 <= offset <= 32768 and int(chunk.min()) >= -offset:
+        # Every shifted value fits in 0..65535: add in uint16, where the two's-complement
+        # wraparound of the int16 bits gives exactly chunk + offset (no int32 copy, no clip)
+        return np.add(chunk.view(np.uint16), np.uint16(offset), out=out)
+
+    # Values would not fit in uint16: shift in int32 and clip to the uint16 range
+    chunk_int32 = np.add(chunk, offset, dtype=np.int32)
     np.clip(chunk_int32, 0, 65535, out=chunk_int32)
-    return chunk_int32.astype(np.uint16)
+    np.copyto(out, chunk_int32, casting='unsafe')
+    return out
 
 
 def load_tiff_file(filepath, n_planes, n_frames_per_plane):
@@ -30,32 +48,65 @@ def load_tiff_file(filepath, n_planes, n_frames_per_plane):
 
     Parameters:
     - filepath (Path): Path to the TIFF file.
+    - n_planes (int or None): Planes per volume, used to trim a truncated file to whole volumes.
+    - n_frames_per_plane (int or None): Frames per plane, used with n_planes.
 
     Returns:
     - np.ndarray: 3D array (frames, height, width).
     """
 
-    frames = []
     with tf.TiffFile(filepath) as tif:
-        for i, page in enumerate(tif.pages):
+        pages = tif.pages
+        first = pages[0]
+        # Decode every page straight into one preallocated stack (no list of frames + np.stack copy)
+        frames = np.empty((len(pages), *first.shape), dtype=first.dtype)
+        n_read = len(pages)
+        try:
+            # All pages in one call: tifffile decodes compressed pages on parallel threads
+            tif.asarray(key=range(n_read), out=frames, maxworkers=DECODE_WORKERS)
+            return frames
+        except Exception:
+            pass  # damaged file: read page by page below to keep what is readable
+        for i in range(len(pages)):
             try:
-                arr = page.asarray()
-                frames.append(arr)
+                pages[i].asarray(out=frames[i])
             except Exception as e:
                 print(f"⚠️ {filepath.name}: stopped at frame {i} due to error: {e}")
-                # frame to remove to make it divisible by n_planes * n_frames_per_plane
-                to_remove = len(frames)%(n_planes * n_frames_per_plane)
-                frames = frames[:-to_remove]
+                # keep only complete volumes: drop frames to make it divisible by n_planes * n_frames_per_plane
+                frames_per_cycle = n_planes * n_frames_per_plane if n_planes and n_frames_per_plane else 1
+                n_read = i - i % frames_per_cycle
                 break  # stop reading further pages
-    if not frames:
+    if n_read == 0:
         raise ValueError(f"{filepath.name}: no readable frames")
 
-    return np.stack(frames)
+    return frames[:n_read]
 
     # with tf.TiffFile(filepath) as tif:
     #     return np.stack([page.asarray() for page in tif.pages])
 
 
+def open_raw_block(filepath, n_planes, n_frames_per_plane):
+    """
+    Open a raw TIFF block as a 3D array, memory-mapped when the file allows it.
+
+    Uncompressed files with contiguous image data are mapped without reading them;
+    anything else is decoded with load_tiff_file.
+
+    Parameters:
+    - filepath (Path): Path to the TIFF file.
+    - n_planes (int or None): Planes per volume (see load_tiff_file).
+    - n_frames_per_plane (int or None): Frames per plane (see load_tiff_file).
+
+    Returns:
+    - np.ndarray: 3D array (frames, height, width), possibly a read-only memmap.
+    """
+    try:
+        frames = tf.memmap(filepath, mode='r')
+    except ValueError:
+        return load_tiff_file(filepath, n_planes, n_frames_per_plane)
+    return frames.reshape(-1, *frames.shape[-2:])
+
+
 def remove_vflyback_frames(frames, frames_per_volume, vflyback_frames=1):
     """
     Remove volume flyback frame (black frame) from each volume.
@@ -72,17 +123,25 @@ def remove_vflyback_frames(frames, frames_per_volume, vflyback_frames=1):
     if total_frames % frames_per_volume != 0:
         print(f"⚠️ Warning: {total_frames} frames not divisible by {frames_per_volume}. Some frames may be dropped.")
 
-    # Build index to keep frames except flyback frames
-    keep_idx = np.array([
-        i for i in range(total_frames)
-        if (i % frames_per_volume) < (frames_per_volume - vflyback_frames)])
-
-    return frames[keep_idx]
+    # Drop the flyback frames with a strided view: (volumes, frames_per_volume, H, W)[:, :kept]
+    n_volumes, remainder = divmod(total_frames, frames_per_volume)
+    kept_per_volume = frames_per_volume - vflyback_frames
+    frame_shape = frames.shape[1:]
+    kept = frames[:n_volumes * frames_per_volume].reshape(n_volumes, frames_per_volume, *frame_shape)
+    kept = kept[:, :kept_per_volume].reshape(-1, *frame_shape)
+    if remainder:
+        # Incomplete last volume: keep its leading frames, as before
+        tail = frames[n_volumes * frames_per_volume:][:kept_per_volume]
+        kept = np.concatenate([kept, tail], axis=0)
+    return kept
 
 
 def correct_negative_values_mp_safe(frames, num_chunks=5):
     """
-   Correct negative pixel values using multiprocessing.
+   Correct negative pixel values, in chunks processed on parallel threads.
+
+   A writable int16 stack (as returned by concatenate_blocks) is corrected in place
+   and returned as a uint16 view of the same memory; other inputs are copied.
 
    Parameters:
    - frames (np.ndarray): Original image stack, uint16.
@@ -94,38 +153,90 @@ def correct_negative_values_mp_safe(frames, num_chunks=5):
 
     min_value = np.min(frames)
     print(f"  min: {min_value}, max: {np.max(frames)}")
+    in_place = frames.dtype == np.int16 and frames.flags.writeable
 
     if min_value >= 0:
         print("  No negative values to correct.")
-        return frames.astype(np.uint16)
+        # Non-negative int16 values have the same bits as uint16
+        return frames.view(np.uint16) if in_place else frames.astype(np.uint16)
 
-    offset = abs(min_value)
-    corrected = np.empty(frames.shape, dtype=np.uint16)
+    offset = abs(int(min_value))  # Python int: abs(np.int16(-32768)) would overflow
+    corrected = frames.view(np.uint16) if in_place else np.empty(frames.shape, dtype=np.uint16)
     chunk_size = int(np.ceil(frames.shape[0] / num_chunks))
 
-    for i in range(num_chunks):
+    def correct_chunk(i):
         start = i * chunk_size
         end = min((i + 1) * chunk_size, frames.shape[0])
-        chunk = frames[start:end]
-        corrected_chunk = correct_chunk_int16_to_uint16(chunk, offset)
-        corrected[start:end] = corrected_chunk
+        if in_place:
+            # offset = -min, so every shifted value fits in uint16: add on the uint16 view
+            # (two's-complement wraparound), no clipping and no second stack needed
+            np.add(corrected[start:end], np.uint16(offset), out=corrected[start:end])
+        else:
+            correct_chunk_int16_to_uint16(frames[start:end], offset, out=corrected[start:end])
         print(f"    Processed chunk {i + 1}/{num_chunks} ({end - start} volumes)")
 
+    # Chunks are independent and numpy releases the GIL: correct them on parallel threads
+    with ThreadPoolExecutor(max_workers=min(num_chunks, os.cpu_count() or 1)) as pool:
+        list(pool.map(correct_chunk, range(num_chunks)))
+
     print(f"  Corrected negative values by adding offset {offset}.")
     print(f"  New min: {np.min(corrected)}, max: {np.max(corrected)}")
     return corrected
 
-def save_stack(output_path, filename, stack):
+def mean_frame_uint16(frames):
+    """
+    Average uint16 frames into one uint16 frame using integer arithmetic.
+
+    Sums in uint32 (exact, half the bytes of a float64 mean) and rounds half to even,
+    giving the same result as np.round(frames.mean(axis=0)).astype(np.uint16).
+
+    Parameters:
+    - frames (np.ndarray): Frames to average (k, H, W), uint16.
+
+    Returns:
+    - np.ndarray: Mean frame (H, W), uint16.
+    """
+    k = len(frames)
+    quotient, remainder = np.divmod(np.add.reduce(frames, axis=0, dtype=np.uint32), k)
+    twice_remainder = 2 * remainder
+    quotient += (twice_remainder > k) | ((twice_remainder == k) & (quotient % 2 == 1))
+    return quotient.astype(np.uint16)
+
+
+def save_stack(output_path, filename, stack, shape=None, dtype=None):
     """
     Save image stack as TIFF.
 
     Parameters:
     - output_path (Path): Directory to save file.
     - filename (str): Output TIFF filename.
-    - stack (np.ndarray): Image stack to save.
+    - stack (np.ndarray or iterator): Image stack to save, or an iterator yielding its frames.
+    - shape (tuple or None): Stack shape (required for an iterator).
+    - dtype (np.dtype or None): Stack dtype (required for an iterator).
     """
     output_path.mkdir(parents=True, exist_ok=True)
-    tf.imwrite(output_path / filename, stack, photometric='minisblack')
+    # Large write buffer: far fewer write() calls, which matters most on network drives.
+    # BigTIFF so stacks over 4 GB are written safely.
+    with open(output_path / filename, 'wb', buffering=WRITE_BUFFER_SIZE) as f:
+        with tf.TiffWriter(f, bigtiff=True) as tw:
+            tw.write(stack, shape=shape, dtype=dtype, photometric='minisblack', contiguous=True)
+
+
+def list_tifs(folder):
+    """
+    List the TIFF files in a folder, sorted by name.
+
+    Uses one os.scandir listing (entry types come with it, no stat per file).
+
+    Parameters:
+    - folder (Path): Folder to list.
+
+    Returns:
+    - list[Path]: Sorted TIFF files.
+    """
+    with os.scandir(folder) as it:
+        return sorted((Path(e.path) for e in it if e.name.endswith('.tif') and e.is_file()),
+                      key=lambda p: p.name)
 
 
 def extract_block_number(tif_file):
@@ -145,7 +256,75 @@ def extract_block_number(tif_file):
         return None
 
 
-def concatenate_blocks(fish_id, input_base, protocol, blocks=None, n_planes=None, n_frames_per_plane=None, volume_flyback_frames=1, remove_first_frame=False):
+def load_block(tif_file, protocol, n_planes=None, n_frames_per_plane=None, volume_flyback_frames=1, remove_first_frame=False):
+    """
+    Load one raw block. For resonant protocol, also remove flyback and reshape.
+
+    Parameters:
+    - tif_file (Path): Raw TIFF block.
+    - protocol (str): 'resonant' or 'linear'.
+    - n_planes (int): Number of planes (only for resonant).
+    - n_frames_per_plane (int): Frames per plane (only for resonant).
+    - volume_flyback_frames (int): Volume flyback frames (only for resonant).
+    - remove_first_frame (bool): Whether to remove the first frame of each plane (only for resonant).
+
+    Returns:
+    - np.ndarray: (frames, H, W) for linear, (volumes * n_planes, frames_per_plane, H, W) for resonant.
+    """
+    print(f"  Loading {tif_file.name}")
+    frames = open_raw_block(tif_file, n_planes, n_frames_per_plane)
+
+    if protocol == "resonant":
+        frames_per_volume = n_planes * n_frames_per_plane + volume_flyback_frames
+        if volume_flyback_frames > 0:
+            print(f"  Removing {volume_flyback_frames} flyback frames per volume.")
+            # Remove flyback frames and reshape for plane extraction
+            frames = remove_vflyback_frames(frames, frames_per_volume, volume_flyback_frames)
+
+        frames = frames.reshape(-1, n_frames_per_plane, frames.shape[1], frames.shape[2]) # Reshape to (volumes, frames_per_plane, H, W)
+
+        if remove_first_frame:
+            frames = frames[:, 1:, :, :]
+
+    return frames
+
+
+def block_shape(tif_file, protocol, n_planes=None, n_frames_per_plane=None, volume_flyback_frames=1, remove_first_frame=False):
+    """
+    Shape and dtype load_block returns for a raw block, read from the TIFF headers only.
+
+    The number of frames is an upper bound: load_block can return fewer rows for a
+    damaged file, trimmed to whole volumes.
+
+    Parameters:
+    - tif_file (Path): Raw TIFF block.
+    - protocol, n_planes, n_frames_per_plane, volume_flyback_frames, remove_first_frame: as in load_block.
+
+    Returns:
+    - tuple: (shape, dtype).
+    """
+    with tf.TiffFile(tif_file) as tif:
+        first = tif.pages[0]
+        series_shape = tif.series[0].shape
+        # open_raw_block maps the whole series, load_tiff_file reads every page
+        n_frames = max(len(tif.pages), int(np.prod(series_shape[:-2])))
+        frame_shape = tuple(first.shape[-2:])
+        dtype = first.dtype
+
+    if protocol != "resonant":
+        return (n_frames, *frame_shape), dtype
+
+    frames_per_volume = n_planes * n_frames_per_plane + volume_flyback_frames
+    if volume_flyback_frames > 0:
+        # Same count as remove_vflyback_frames, including a partial last volume
+        n_volumes, remainder = divmod(n_frames, frames_per_volume)
+        kept_per_volume = frames_per_volume - volume_flyback_frames
+        n_frames = n_volumes * kept_per_volume + min(remainder, kept_per_volume)
+    frames_per_row = n_frames_per_plane - 1 if remove_first_frame else n_frames_per_plane
+    return (n_frames // n_frames_per_plane, frames_per_row, *frame_shape), dtype
+
+
+def concatenate_blocks(fish_id, input_base, protocol, blocks=None, n_planes=None, n_frames_per_plane=None, volume_flyback_frames=1, remove_first_frame=False, scratch_dir=None):
     """
     Load and concatenate selected blocks. For resonant protocol, also remove flyback and reshape.
 
@@ -157,42 +336,67 @@ def concatenate_blocks(fish_id, input_base, protocol, blocks=None, n_planes=None
     - n_planes (int): Number of planes (only for resonant).
     - n_frames_per_plane (int): Frames per plane (only for resonant).
     - volume flyback_frames (int): Volume Flyback frames (only for resonant).
+    - scratch_dir (Path or None): If given, the stack is assembled in a memory-mapped
+      `{fish_id}_concatenated.npy` there instead of in RAM (the caller removes the file).
 
     Returns:
     - np.ndarray: Full concatenated image stack.
     """
     raw_folder = Path(input_base) / fish_id / "01_raw/2p/functional"
-    tiffs = sorted(raw_folder.glob("*.tif"))
+    tiffs = list_tifs(raw_folder)
 
-    all_blocks = []
+    selected = []
     for tif_file in tiffs:
         if 'anatomy' not in tif_file.name:
             block_number = extract_block_number(tif_file)
             if blocks is not None and block_number not in blocks:
                 continue
+            selected.append(tif_file)
 
-            print(f"  Loading {tif_file.name}")
-            frames = load_tiff_file(tif_file, n_planes, n_frames_per_plane)
-
-            if protocol == "resonant":
-                frames_per_volume = n_planes * n_frames_per_plane + volume_flyback_frames
-                if volume_flyback_frames > 0:
-                    print(f"  Removing {volume_flyback_frames} flyback frames per volume.")
-                    # Remove flyback frames and reshape for plane extraction
-                    frames = remove_vflyback_frames(frames, frames_per_volume, volume_flyback_frames)
-
-                frames = frames.reshape(-1, n_frames_per_plane, frames.shape[1], frames.shape[2]) # Reshape to (volumes, frames_per_plane, H, W)
-
-                if remove_first_frame:
-                    frames = frames[:, 1:, :, :]
-
-            all_blocks.append(frames)
-
-    if not all_blocks:
+    if not selected:
         raise ValueError("No matching TIFF files found for selected blocks.")
 
-    # Concatenate all loaded blocks into single array
-    full_stack = np.concatenate(all_blocks, axis=0)
+    def load(tif_file):
+        return load_block(tif_file, protocol, n_planes, n_frames_per_plane, volume_flyback_frames, remove_first_frame)
+
+    # Blocks are read/decoded concurrently (tifffile and numpy release the GIL)
+    with ThreadPoolExecutor(max_workers=BLOCK_READ_WORKERS) as pool:
+        if scratch_dir is None:
+            full_stack = np.concatenate(list(pool.map(load, selected)), axis=0)
+        else:
+            # Disk-backed stack sized from the TIFF headers before any block is decoded; blocks
+            # are decoded at most BLOCK_READ_WORKERS ahead and copied in order, each one
+            # released as soon as it is in the stack
+            shapes = [block_shape(tif_file, protocol, n_planes, n_frames_per_plane,
+                                  volume_flyback_frames, remove_first_frame) for tif_file in selected]
+            (_, *row_shape), dtype = shapes[0]
+            n_rows = sum(shape[0] for shape, _ in shapes)
+            scratch_file = Path(scratch_dir) / f"{fish_id}_concatenated.npy"
+            full_stack = np.lib.format.open_memmap(scratch_file, mode='w+', dtype=dtype, shape=(n_rows, *row_shape))
+
+            def store(block, start):
+                if start + len(block) > n_rows or block.shape[1:] != tuple(row_shape):
+                    raise ValueError(f"Block of shape {block.shape} does not fit the stack {full_stack.shape}.")
+                full_stack[start:start + len(block)] = block
+                return start + len(block)
+
+            start = 0
+            pending = deque()
+            try:
+                for tif_file in selected:
+                    pending.append(pool.submit(load, tif_file))
+                    if len(pending) > BLOCK_READ_WORKERS:
+                        start = store(pending.popleft().result(), start)
+                while pending:
+                    start = store(pending.popleft().result(), start)
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                del full_stack
+                scratch_file.unlink(missing_ok=True)  # the caller never gets the file to clean up
+                raise
+            if start < n_rows:
+                full_stack = full_stack[:start]  # damaged blocks came out shorter than their headers
     print(f"  Full concatenated stack shape: {full_stack.shape}")
     return full_stack
 
@@ -211,49 +415,62 @@ def process_fish(fish_id, input_base, output_base, protocol="resonant", blocks=N
     - volume_flyback_frames (int): Volume flyback frames (only resonant).
     - remove_first_frame (bool): Whether to remove the first frame in resonant protocol.
     """
-    full_stack = concatenate_blocks(fish_id, input_base, protocol, blocks, n_planes, n_frames_per_plane, volume_flyback_frames, remove_first_frame)
-    full_stack = correct_negative_values_mp_safe(full_stack)
+    if protocol not in ("resonant", "linear"):
+        raise ValueError(f"Unknown protocol type: {protocol}")
+
     output_path = Path(output_base) / fish_id / "02_reg/00_preprocessing/2p_functional/01_individualPlanes"
     output_path.mkdir(parents=True, exist_ok=True)
 
-    if protocol == "resonant":
-        for plane_idx in range(n_planes):
-            # Extract one plane across all volumes
-            avg_plane = np.mean(full_stack, axis=1)[plane_idx::n_planes]
-            avg_plane = np.round(avg_plane).astype(np.uint16)
-            save_stack(output_path, f"{fish_id}_plane{plane_idx}.tif", avg_plane)
-            print(f"  Saved plane {plane_idx}")
-            del avg_plane
-            gc.collect()
-
-        metadata = {
-            "protocol": "resonant",
-            "n_planes": n_planes,
-            "n_frames_per_plane": n_frames_per_plane,
-            "blocks": blocks,
-            "volume_flyback_frames": volume_flyback_frames,
-            "remove_first_frame": remove_first_frame,
-            "fish_id": fish_id,
-            "output_path": str(output_path),
-            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
-        }
-
-    elif protocol == "linear":
-        save_stack(output_path, f"{fish_id}_stack.tif", full_stack)
-
-        metadata = {
-            "protocol": "linear",
-            "blocks": blocks,
-            "fish_id": fish_id,
-            "output_path": str(output_path),
-            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
-        }
-
-    else:
-        raise ValueError(f"Unknown protocol type: {protocol}")
-
-    del full_stack
-    gc.collect()
+    # The raw concatenation lives in a memory-mapped scratch file next to the outputs
+    full_stack = concatenate_blocks(fish_id, input_base, protocol, blocks, n_planes, n_frames_per_plane, volume_flyback_frames, remove_first_frame, scratch_dir=output_path)
+    scratch_file = Path(full_stack.filename)
+    try:
+        full_stack = correct_negative_values_mp_safe(full_stack)  # in place, still backed by the scratch file
+
+        if protocol == "resonant":
+            plane_n_frames = []
+            for plane_idx in range(n_planes):
+                # Extract one plane across all volumes, averaged and written frame by frame
+                plane_rows = range(plane_idx, len(full_stack), n_planes)
+                avg_frames = (mean_frame_uint16(full_stack[i]) for i in plane_rows)
+                save_stack(output_path, f"{fish_id}_plane{plane_idx}.tif", avg_frames,
+                           shape=(len(plane_rows), *full_stack.shape[2:]), dtype=np.uint16)
+                plane_n_frames.append(len(plane_rows))
+                print(f"  Saved plane {plane_idx}")
+
+            metadata = {
+                "protocol": "resonant",
+                "n_planes": n_planes,
+                "n_frames_per_plane": n_frames_per_plane,
+                "blocks": blocks,
+                "volume_flyback_frames": volume_flyback_frames,
+                "remove_first_frame": remove_first_frame,
+                "plane_n_frames": plane_n_frames,  # frames in each {fish_id}_plane{i}.tif
+                "fish_id": fish_id,
+                "output_path": str(output_path),
+                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+            }
+
+        elif protocol == "linear":
+            save_stack(output_path, f"{fish_id}_stack.tif", full_stack)
+
+            metadata = {
+                "protocol": "linear",
+                "blocks": blocks,
+                "n_frames": len(full_stack),
+                "fish_id": fish_id,
+                "output_path": str(output_path),
+                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+            }
+    finally:
+        # Release the stack and its scratch file as soon as the outputs are written,
+        # also when writing fails, so no multi-GB scratch file is left behind
+        del full_stack
+        gc.collect()
+        try:
+            scratch_file.unlink()  # only possible once the memory map is closed (Windows)
+        except OSError as e:
+            print(f"⚠️ Could not remove scratch file {scratch_file}: {e}")
 
     with open(output_path / f"{fish_id}_preprocessing_metadata.json", "w") as f:
         json.dump(metadata, f, indent=4)
@@ -281,8 +498,11 @@ def parallel_preprocess(fish_ids, input_base, output_base, protocol="resonant",
         # Prepare arguments for each fish to be processed in parallel
         jobs.append((fish_id, input_base, output_base, protocol, blocks, n_planes, n_frames_per_plane, volume_flyback_frames, remove_first_frame))
 
-    with mp.Pool(processes=mp.cpu_count()) as pool:
-        pool.starmap(process_fish, jobs)
+    # A few fish at a time: every worker streams whole raw stacks from disk, so more workers
+    # than that only contend for the same disk (and multiply the peak memory)
+    n_workers = max(1, min(len(jobs), MAX_FISH_WORKERS, os.cpu_count() or 1))
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        list(pool.map(process_fish, *zip(*jobs)))  # list() re-raises worker errors
 
 
 if __name__ == "__main__":
@@ -1,5 +1,10 @@
+import csv
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
+
 def init_experiment_tree(base_dir, fish_name):
     """
     Create standard folder tree for a 2p experiment and return key paths.
@@ -15,7 +20,7 @@ def init_experiment_tree(base_dir, fish_name):
     -------
     dict
         Useful paths: root, raw_2p_metadata, raw_2p_functional, raw_2p_anatomy,
-        analysis_suite2p, plots.
+        preproc_individual_planes, preproc_motion_corrected, analysis_suite2p, plots.
     """
     root = base_dir / fish_name
 
@@ -66,6 +71,187 @@ def init_experiment_tree(base_dir, fish_name):
         "raw_2p_metadata": root / "01_raw/2p/metadata",
         "raw_2p_functional": root / "01_raw/2p/functional",
         "raw_2p_anatomy": root / "01_raw/2p/anatomy",
+        "preproc_individual_planes": root / "02_reg/00_preprocessing/2p_functional/01_individualPlanes",
+        "preproc_motion_corrected": root / "02_reg/00_preprocessing/2p_functional/02_motionCorrected",
         "analysis_suite2p": root / "03_analysis/functional/suite2P",
         "plots": root / "04_plots",
-    }
\ No newline at end of file
+    }
+
+# Stimulus arrays are float32: dot positions and radii in cm need about 3 decimals,
+# and half-size rows keep the per-frame working set small
+STIMULUS_DTYPE = np.float32
+
+
+def stimulus_to_array(df, fields=("x", "y", "radius")):
+    """
+    Convert a dot stimulus table into a float32 array indexed by frame and dot.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Stimulus table with columns dot<i>_<field> (e.g. dot0_x, dot0_y, dot0_radius).
+    fields : tuple of str
+        Per-dot columns to extract, in order.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (n_frames, n_dots, len(fields)), dtype STIMULUS_DTYPE.
+    """
+    n_dots = sum(1 for col in df.columns if col.startswith("dot") and col.endswith("_x"))
+    columns = [f"dot{d}_{field}" for d in range(n_dots) for field in fields]
+    return df[columns].to_numpy(dtype=STIMULUS_DTYPE).reshape(len(df), n_dots, len(fields))
+
+
+STIMULI_CACHE_DIR = "npy"
+
+
+def _load_stimulus(file_path, cache_dir, fields):
+    """Memory-map the cached .npy of one stimulus CSV, converting the CSV first if needed."""
+    npy_path = cache_dir / f"{file_path.stem}.{'-'.join(fields)}.npy"
+    try:
+        if npy_path.stat().st_mtime_ns >= file_path.stat().st_mtime_ns:
+            return np.load(npy_path, mmap_mode="r")
+    except (OSError, ValueError):
+        pass  # missing, stale or unreadable .npy: convert the CSV again
+
+    array = stimulus_to_array(pd.read_csv(file_path), fields)
+    try:
+        cache_dir.mkdir(exist_ok=True)
+        np.save(npy_path, array)
+    except OSError:
+        pass  # e.g. read-only stimuli folder; the CSV is parsed again next time
+    return array
+
+
+def load_stimulus(file_path, fields=("x", "y", "radius")):
+    """
+    Load one stimulus CSV as a float32 array, through the same .npy cache as load_stimuli.
+
+    Parameters
+    ----------
+    file_path : Path
+        Stimulus CSV file.
+    fields : tuple of str
+        Per-dot columns to extract (see stimulus_to_array).
+
+    Returns
+    -------
+    np.ndarray
+        Read-only array (n_frames, n_dots, len(fields)).
+    """
+    return _load_stimulus(file_path, file_path.parent / STIMULI_CACHE_DIR, fields)
+
+
+def load_stimuli(stimuli_path, fields=("x", "y", "radius")):
+    """
+    Load every stimulus CSV in a folder as float32 arrays.
+
+    Each CSV is converted once to a binary .npy file (in an npy/ subfolder of the
+    stimuli folder) and later runs memory-map that file instead of parsing the CSV.
+    A .npy file is regenerated whenever its CSV has been modified since. Files are
+    loaded in parallel threads.
+
+    Parameters
+    ----------
+    stimuli_path : Path
+        Folder containing the stimulus CSV files.
+    fields : tuple of str
+        Per-dot columns to extract (see stimulus_to_array).
+
+    Returns
+    -------
+    dict
+        Stimulus key (file stem up to the first '_') -> read-only array
+        (n_frames, n_dots, len(fields)).
+    """
+    csv_files = sorted(stimuli_path.glob("*.csv"))
+    cache_dir = stimuli_path / STIMULI_CACHE_DIR
+    with ThreadPoolExecutor() as pool:
+        arrays = pool.map(lambda file_path: _load_stimulus(file_path, cache_dir, fields), csv_files)
+        return {file_path.stem.split("_")[0]: array for file_path, array in zip(csv_files, arrays)}
+
+
+def write_csv(path, header, rows):
+    """
+    Write rows to a CSV file with a header line using the csv module.
+
+    Parameters
+    ----------
+    path : Path or file object
+        Output CSV file (overwritten if it exists), or a text file already opened
+        for writing with newline="" (left open; closing it is up to the caller).
+    header : list of str
+        Column names.
+    rows : iterable of sequences
+        One sequence of values per row.
+    """
+    if not hasattr(path, "write"):
+        with open(path, "w", newline="") as f:
+            write_csv(f, header, rows)
+        return
+    writer = csv.writer(path)
+    writer.writerow(header)
+    writer.writerows(rows)
+
+
+def loom_radii(start_radius_cm, end_radius_cm, duration_sec, fps, pixel_cm_ratio):
+    """
+    Per-frame radius of the looming circle, in pixels.
+
+    The radius grows linearly from start_radius_cm by the same step every frame and
+    reaches end_radius_cm on the last frame.
+
+    Parameters
+    ----------
+    start_radius_cm, end_radius_cm : float
+        Radius before the first frame and on the last frame, in cm.
+    duration_sec : float
+        Duration of the loom.
+    fps : int
+        Frame rate of the display.
+    pixel_cm_ratio : float
+        Pixels per cm of the display.
+
+    Returns
+    -------
+    list of float
+        One radius per frame (fps * duration_sec frames).
+    """
+    n_frames = int(round(fps * duration_sec))
+    step = (end_radius_cm - start_radius_cm) * pixel_cm_ratio / n_frames
+    return (start_radius_cm * pixel_cm_ratio + np.arange(1, n_frames + 1) * step).tolist()
+
+
+# Single-byte commands of visual_stimulation/trigger_pulse/trigger_pulse.ino
+ACQ_PULSE = b'P'  # pulse the acquisition trigger (pin 11)
+AUX_HIGH = b'H'   # auxiliary trigger (pin 13) high while a stimulus is shown
+AUX_LOW = b'L'
+SYNC_HIGH = b'S'  # synchronization signal (pin 12)
+SYNC_LOW = b's'
+TRIGGER_PORT = "COM3"
+
+
+def open_trigger_board(port=TRIGGER_PORT):
+    """
+    Open the serial connection to the Arduino running trigger_pulse.ino.
+
+    Opening the port resets the board; this waits until it reports ready.
+
+    Parameters
+    ----------
+    port : str
+        Serial port of the board.
+
+    Returns
+    -------
+    serial.Serial
+        Open connection; write the command bytes above to it.
+    """
+    import serial  # pyserial is only needed by the stimulation scripts
+
+    board = serial.Serial(port, 115200, timeout=5)
+    if board.read(1) != b'R':
+        board.close()
+        raise RuntimeError(f"Arduino on {port} did not report ready (is trigger_pulse.ino flashed?)")
+    return board
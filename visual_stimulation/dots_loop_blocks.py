@@ -15,21 +15,22 @@ Updated: 2025-10-07
 
 # Imports and Setup
 from psychopy import visual, core, event, monitors, tools, gui, data
-import tkinter as tk
-from tkinter import filedialog
-from pyfirmata import Arduino
-import pandas as pd
+import numpy as np
 import datetime
+from concurrent.futures import ThreadPoolExecutor
+import json
 from pathlib import Path
-from utils import init_experiment_tree
+from utils import (STIMULUS_DTYPE, ACQ_PULSE, AUX_HIGH, AUX_LOW, init_experiment_tree, load_stimuli,
+                   open_trigger_board, write_csv)
 
 # ===== GUI: Select stimuli folder =====
-root_tk = tk.Tk()
-root_tk.withdraw() # Hide the small Tkinter window
-stimuli_path_str = filedialog.askdirectory(title="Select the folder containing the stimulus CSV files")
-if not stimuli_path_str:
+# PsychoPy's own (Qt) file dialog, the same toolkit as the parameter dialogs: pick any
+# stimulus CSV and its folder is taken as the stimulus set
+stimuli_files = gui.fileOpenDlg(prompt="Select a stimulus CSV file in the stimuli folder",
+                                allowed="Stimulus CSV files (*.csv)")
+if not stimuli_files:
     core.quit()
-stimuli_path = Path(stimuli_path_str)
+stimuli_path = Path(stimuli_files[0]).parent
 
 
 # ===== Monitor & window settings =====
@@ -39,6 +40,11 @@ monitor.setSizePix(PIXELS_MONITOR)
 PIXEL_CM_RATIO = tools.monitorunittools.cm2pix(1, monitor)  # pixels per centimeter
 monitor.setDistance(1)
 FPS = 60
+# Preallocated event log rows: block number and event name are kept apart and only
+# joined into the 'B<block>_<event>' label when the log is saved
+EVENT_LOG_DTYPE = [('block', 'i4'), ('event', 'U32'), ('timestamp', 'f8')]
+TRIAL_LOG_DTYPE = [('trial', 'i4'), ('block', 'i4'), ('stimulus', 'U64'), ('prestim_t', 'f8'),
+                   ('stim_t', 'f8'), ('stim_block_t', 'f8'), ('poststim_t', 'f8')]  # one row per trial
 
 # ===== Base data root =====
 data_path = Path(r'Z:\FAC\FBM\CIG\jlarsch\default\D2c\07_Data')
@@ -113,6 +119,14 @@ fish_birth = datetime.datetime.strptime(metadata['fish_birth'], "%Y-%m-%d")
 today = datetime.datetime.today()
 metadata['fish_age_dpf'] = (today - fish_birth).days
 metadata['path_to_stimuli'] = str(stimuli_path)
+metadata['stimulus_dtype'] = np.dtype(STIMULUS_DTYPE).name  # precision of the displayed positions/radii
+
+# Pause lengths in seconds, computed once; nothing changes on screen during pauses,
+# so they are a single flip followed by core.wait instead of a per-frame flip loop
+RESTING_SEC = float(stimuli_params['pre_stim_resting_sec'])
+PRE_STIM_PAUSE_SEC = float(stimuli_params['pre_stim_pause_sec'])
+POST_STIM_PAUSE_SEC = float(stimuli_params['post_stim_pause_sec'])
+INTER_BLOCK_PAUSE_SEC = float(stimuli_params['inter_block_pause_sec'])
 
 # ===== Build experiment folder structure =====
 data_root = data_path / str(metadata["experimenter"]) / 'Microscopy'
@@ -120,143 +134,189 @@ exp_name = str(metadata["fish_ID"])  # if you want L500_f01: exp_name = f"L500_f
 paths = init_experiment_tree(data_root, exp_name)
 meta_dir = paths["raw_2p_metadata"]       # where we save logs and parameter CSVs
 
-# ===== Load stimuli CSVs =====
-stimuli = {}
-for file_path in stimuli_path.glob("*.csv"):
-    df = pd.read_csv(file_path)
-    key = file_path.stem.split("_")[0]
-    stimuli[key] = df
+# Persist the dialog values right away so they survive a crash during the run
+start_date = datetime.datetime.now().strftime("%Y-%m-%d-%H%M")
+log_prefix = f"{start_date}_f{metadata['fish_ID']}"  # shared by every file saved for this run
+with open(meta_dir / f"{log_prefix}_metadata.json", "w") as f:
+    json.dump({'metadata': metadata, 'stimuli_params': stimuli_params,
+               'functional_params': functional_params}, f, indent=2, default=str)
 
-# Assume all CSVs have the same number of frames
-conditions = [{"stimulus": key} for key in stimuli.keys()]
-trials = data.TrialHandler(nReps=stimuli_params["n_rep_stim"], method="random", trialList=conditions, name="trials")
-trial_sequence = []
+# ===== Load stimuli CSVs =====
+# Loaded in a background thread so parsing overlaps with window creation and the Arduino handshake
+stimuli_loader = ThreadPoolExecutor(max_workers=1)
+stimuli_future = stimuli_loader.submit(load_stimuli, stimuli_path)
 
 # ===== PsychoPy window =====
 win = visual.Window(size=PIXELS_MONITOR, color="red", units="pix", monitor=monitor, screen=1, fullscr=True)
 
+# ===== Arduino connection and trigger pins =====
+# The board runs trigger_pulse/trigger_pulse.ino: each trigger is a single serial byte
+# (ACQ_PULSE, AUX_HIGH/AUX_LOW) and the pulse itself is timed on the board
+board = open_trigger_board()
+
+# ===== Stimuli and trial order =====
+stimuli = stimuli_future.result()  # key -> float32 array (n_frames, n_dots, [x, y, radius])
+stimuli_loader.shutdown()
+too_many_dots = [key for key, stim_frames in stimuli.items() if stim_frames.shape[1] > stimuli_params["max_n_dots"]]
+if too_many_dots:
+    raise ValueError(f"Stimuli with more than max_n_dots={stimuli_params['max_n_dots']} dots: {too_many_dots}")
+
+# Frames as handed to the dot field, computed once per stimulus for the whole run:
+# positions with the orientation flip baked in, diameters (2 * radius), and whether
+# the sizes stay constant over the stimulus (selects the frame loop below)
+display_frames = {}
+for stimulus_key, stim_frames in stimuli.items():
+    stim_xys = stim_frames[:, :, :2] * (-1.0 if flip_coordinates else 1.0)
+    stim_sizes = 2 * stim_frames[:, :, 2]
+    display_frames[stimulus_key] = (stim_xys, stim_sizes, bool(np.all(stim_sizes == stim_sizes[0])))
+
+# One ElementArrayStim per dot count in the stimulus set: all dots of a frame are
+# drawn with a single call (sizes are diameters, i.e. 2 * radius)
+dot_fields = {
+    n_dots: visual.ElementArrayStim(win=win, nElements=n_dots, xys=np.zeros((n_dots, 2)),
+                                    sizes=0.4, elementTex=None, elementMask="circle",  # 0.2 cm radius
+                                    colors=(-1, -1, -1), colorSpace="rgb", units="cm", autoLog=False)
+    for n_dots in {stim_frames.shape[1] for stim_frames in stimuli.values()}
+}
 
-dots = [visual.Circle(win=win, radius=0.2, fillColor="black", pos=[0, 0], units="cm")
-        for _ in range(stimuli_params["max_n_dots"])]
+# Assume all CSVs have the same number of frames
+conditions = [{"stimulus": key} for key in stimuli.keys()]
+trials = data.TrialHandler(nReps=stimuli_params["n_rep_stim"], method="random", trialList=conditions, name="trials")
+trial_sequence = []
 
-# ===== Arduino connection and trigger pins =====
-board = Arduino("COM3")
-ACQ_TRIGGER_PIN = 11
-AUX_TRIGGER_PIN = 13
-pin_acq = board.get_pin(f'd:{ACQ_TRIGGER_PIN}:o')
-pin_aux = board.get_pin(f'd:{AUX_TRIGGER_PIN}:o')
-pin_acq.write(0)
-pin_aux.write(0)
+# ===== Warm-up before the first acquisition trigger =====
+# Draw the first frame of every stimulus so textures/shaders and driver state are
+# initialised now rather than during the first recorded block; the back buffer is
+# cleared before flipping so nothing is shown to the fish.
+for stim_xys, stim_sizes, _ in display_frames.values():
+    dot_field = dot_fields[stim_xys.shape[1]]
+    dot_field.xys = stim_xys[0]
+    dot_field.sizes = stim_sizes[0]
+    dot_field.draw()
+    win.clearBuffer()
+win.flip()
+win.flip()
+
+# ===== Log files =====
+# Opened only once the window, the board and the stimuli are ready, so a failed start
+# leaves no empty logs behind; saving at the end then does no path lookups or file
+# creation on the network share
+exp_log_file = open(meta_dir / f"{log_prefix}_experiment_log.csv", "w", newline="")
+block_log_file = open(meta_dir / f"{log_prefix}_block_log.csv", "w", newline="")
+trial_log_file = open(meta_dir / f"{log_prefix}_trial_log.csv", "w", newline="")
+trial_sequence_file = open(meta_dir / f"{log_prefix}_trial_sequence.csv", "w", newline="")
 
 # ===== Logging / clocks =====
-exp_event_log = []
-block_event_log = []
+# Logs are preallocated and filled by index: one record per trial, and the block
+# boundary events (3 per block, plus experiment start/end) in the two event logs
+n_trials = trials.nTotal
+max_events = 3 * (n_trials // stimuli_params["n_trials_per_block"] + 1) + 2
+trial_log = np.empty(n_trials, dtype=TRIAL_LOG_DTYPE)
+n_logged_trials = 0
+exp_event_log = np.empty(max_events, dtype=EVENT_LOG_DTYPE)
+block_event_log = np.empty(max_events, dtype=EVENT_LOG_DTYPE)
+n_exp_events = 0
+n_block_events = 0
 block_num = 0
 exp_clock = core.Clock()
 block_clock = core.Clock()
 
 # ===== Start experiment block =====
-pin_acq.write(1); pin_acq.write(0)
-exp_event_log.append({'event': f'B{block_num}_start', 'timestamp': exp_clock.getTime()})
-block_event_log.append({'event': f'B{block_num}_start', 'timestamp': block_clock.getTime()})
+board.write(ACQ_PULSE)
+exp_event_log[n_exp_events] = (block_num, 'start', exp_clock.getTime())
+n_exp_events += 1
+block_event_log[n_block_events] = (block_num, 'start', block_clock.getTime())
+n_block_events += 1
 print("Experiment started and trigger sent")
 
 try:
-    # # Spontaneous activity (blank screen)
-    for frame in range(int(round(FPS * float(stimuli_params['pre_stim_resting_sec']), 1))):
-        win.flip()
+    # # Spontaneous activity (blank screen): nothing changes on screen, so flip once and wait
+    win.flip()
+    core.wait(RESTING_SEC, hogCPUperiod=0.2)
 
     for idx, trial in enumerate(trials):
         stimulus_key = trial["stimulus"]
-        df = stimuli[stimulus_key]
-        n_dots = len(df.columns) // 3
-        n_frames_trial = len(df)
+        trial_xys, trial_sizes, constant_sizes = display_frames[stimulus_key]
+        n_frames_trial, n_dots = trial_xys.shape[:2]
+        dot_field = dot_fields[n_dots]
         trial_sequence.append(stimulus_key)
 
         # If the block is complete, finish the block, pause, and start a new one
         if idx % stimuli_params["n_trials_per_block"] == 0:
 
-            exp_event_log.append({'event': f'B{block_num}_end', 'timestamp': exp_clock.getTime()})
-            block_event_log.append({'event': f'B{block_num}_end', 'timestamp': block_clock.getTime()})
+            exp_event_log[n_exp_events] = (block_num, 'end', exp_clock.getTime())
+            n_exp_events += 1
+            block_event_log[n_block_events] = (block_num, 'end', block_clock.getTime())
+            n_block_events += 1
 
-            exp_event_log.append({'event': f'B{block_num}_interblock_pause', 'timestamp': exp_clock.getTime()})
+            exp_event_log[n_exp_events] = (block_num, 'interblock_pause', exp_clock.getTime())
+            n_exp_events += 1
             print('inter_block_pause_sec')
-            for _ in range(FPS * stimuli_params['inter_block_pause_sec']):
-                win.flip()
+            win.flip()
+            core.wait(INTER_BLOCK_PAUSE_SEC, hogCPUperiod=0.2)
 
             block_num += 1
-            block_clock = core.Clock()
-            pin_acq.write(1)
-            pin_acq.write(0)
-            exp_event_log.append({'event': f'B{block_num}_start', 'timestamp': exp_clock.getTime()})
-            block_event_log.append({'event': f'B{block_num}_start', 'timestamp': block_clock.getTime()})
-
-        # Pre-stimulus pause
-        exp_event_log.append({'event': f'B{block_num}_prestim{idx}_pause', 'timestamp': exp_clock.getTime()})
-        block_event_log.append({'event': f'B{block_num}_prestim{idx}_pause', 'timestamp': block_clock.getTime()})
-        for _ in range(int(round(FPS * float(stimuli_params['pre_stim_pause_sec']), 1))):
-            win.flip()
+            block_clock.reset()
+            board.write(ACQ_PULSE)
+            exp_event_log[n_exp_events] = (block_num, 'start', exp_clock.getTime())
+            n_exp_events += 1
+            block_event_log[n_block_events] = (block_num, 'start', block_clock.getTime())
+            n_block_events += 1
+
+        # Pre-stimulus pause. The trial row is written now and its onsets filled in as they
+        # happen, so an interrupted run keeps them (times not reached stay NaN)
+        trial_log[n_logged_trials] = (idx, block_num, stimulus_key, exp_clock.getTime(), np.nan, np.nan, np.nan)
+        trial_row = trial_log[n_logged_trials]  # view of the row: field assignments write into trial_log
+        n_logged_trials += 1
+        win.flip()
+        core.wait(PRE_STIM_PAUSE_SEC, hogCPUperiod=0.2)
 
         # Stimulus presentation
-        pin_aux.write(1)
+        board.write(AUX_HIGH)
         print(stimulus_key, 'started')
 
-        exp_event_log.append({'event': f'B{block_num}_stim{idx}_{stimulus_key}', 'timestamp': exp_clock.getTime()})
-        block_event_log.append({'event': f'B{block_num}_stim{idx}_{stimulus_key}', 'timestamp': block_clock.getTime()})
-        for frame in range(n_frames_trial):
-            for dot_idx in range(n_dots):
-                x = df[f'dot{dot_idx}_x'][frame]
-                y = df[f'dot{dot_idx}_y'][frame]
-                radius = df[f'dot{dot_idx}_radius'][frame]
-                if flip_coordinates:
-                    x, y = -x, -y
-                pos = (x, y)
-                dots[dot_idx].radius = radius
-                dots[dot_idx].pos = pos
-                dots[dot_idx].draw()
-            win.flip()
-        pin_aux.write(0)
+        trial_row['stim_t'] = exp_clock.getTime()
+        trial_row['stim_block_t'] = block_clock.getTime()
+        if constant_sizes:
+            # Dot sizes do not change during this trial: set them once, update positions only
+            dot_field.sizes = trial_sizes[0]
+            for frame in range(n_frames_trial):
+                dot_field.xys = trial_xys[frame]
+                dot_field.draw()
+                win.flip()
+        else:
+            for frame in range(n_frames_trial):
+                dot_field.xys = trial_xys[frame]
+                dot_field.sizes = trial_sizes[frame]
+                dot_field.draw()
+                win.flip()
+        board.write(AUX_LOW)
 
         # Post-stimulus pause
-        exp_event_log.append({'event': f'B{block_num}_poststim{idx}_pause', 'timestamp': exp_clock.getTime()})
-        block_event_log.append({'event': f'B{block_num}_poststim{idx}_pause', 'timestamp': block_clock.getTime()})
-        for _ in range(int(round(FPS * float(stimuli_params['pre_stim_pause_sec']), 1))):
-            win.flip()
+        trial_row['poststim_t'] = exp_clock.getTime()
+        win.flip()
+        core.wait(POST_STIM_PAUSE_SEC, hogCPUperiod=0.2)
 
 except KeyboardInterrupt:
     print("\nManual interruption detected. Finalizing and saving logs...")
 
 finally:
     # End experiment
-    exp_event_log.append({'event': f'B{block_num}_end', 'timestamp': exp_clock.getTime()})
-    block_event_log.append({'event': f'B{block_num}_end', 'timestamp': block_clock.getTime()})
+    exp_event_log[n_exp_events] = (block_num, 'end', exp_clock.getTime())
+    n_exp_events += 1
+    block_event_log[n_block_events] = (block_num, 'end', block_clock.getTime())
+    n_block_events += 1
     print("Experiment ended")
     win.close()  # Close the PsychoPy window
 
     # Save logs and trial sequence
-    current_date = datetime.datetime.now().strftime("%Y-%m-%d-%H%M")
-
-    df_experiment_log = pd.DataFrame(exp_event_log)
-    exp_log_filename = f"{current_date}_f{metadata['fish_ID']}_experiment_log.csv"
-    df_experiment_log.to_csv(meta_dir / exp_log_filename, index=False)
-
-    df_block_log = pd.DataFrame(block_event_log)
-    block_log_filename = f"{current_date}_f{metadata['fish_ID']}_block_log.csv"
-    df_block_log.to_csv(meta_dir / block_log_filename, index=False)
-
-    df_trial_sequence = pd.DataFrame(trial_sequence, columns=["stimulus"])
-    trial_sequence_filename = f"{current_date}_f{metadata['fish_ID']}_trial_sequence.csv"
-    df_trial_sequence.to_csv(meta_dir / trial_sequence_filename, index=False)
-
-    # First metadata dump (metadata + stimuli + functional)
-    metadata_list = list(metadata.items())
-    stimuli_params_list = list(stimuli_params.items())
-    functional_list = list(functional_params.items())
-    all_data = metadata_list + stimuli_params_list + functional_list
-    exp_metadata = pd.DataFrame(all_data, columns=["parameter", "value"])
-
-    metadata_filename = f"{current_date}_f{metadata['fish_ID']}_metadata.csv"
-    exp_metadata.to_csv(meta_dir / metadata_filename, index=False)
+    with exp_log_file, block_log_file, trial_log_file, trial_sequence_file:
+        write_csv(exp_log_file, ["event", "timestamp"],
+                  [(f'B{block}_{name}', t) for block, name, t in exp_event_log[:n_exp_events].tolist()])
+        write_csv(block_log_file, ["event", "timestamp"],
+                  [(f'B{block}_{name}', t) for block, name, t in block_event_log[:n_block_events].tolist()])
+        write_csv(trial_log_file, [name for name, _ in TRIAL_LOG_DTYPE], trial_log[:n_logged_trials].tolist())
+        write_csv(trial_sequence_file, ["stimulus"], [(key,) for key in trial_sequence])
 
     # Post-run dialogs for anatomy + fish status (kept as in your script)
     metadata['fish_died'] = False
@@ -273,11 +333,7 @@ finally:
     if not dlg.OK:
         core.quit()
 
-    # Overwrite/update metadata CSV with anatomy appended
-    metadata_list = list(metadata.items())
-    stimuli_params_list = list(stimuli_params.items())
-    functional_list = list(functional_params.items())
-    anatomy_list = list(anatomy_params.items())
-    all_data = metadata_list + stimuli_params_list + functional_list + anatomy_list
-    exp_metadata = pd.DataFrame(all_data, columns=["parameter", "value"])
-    exp_metadata.to_csv(meta_dir / metadata_filename, index=False)
+    # Metadata CSV (metadata + stimuli + functional + anatomy)
+    all_data = [*metadata.items(), *stimuli_params.items(), *functional_params.items(), *anatomy_params.items()]
+    metadata_filename = f"{log_prefix}_metadata.csv"
+    write_csv(meta_dir / metadata_filename, ["parameter", "value"], all_data)
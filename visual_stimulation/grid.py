@@ -7,6 +7,7 @@ Created on 2024-11-11
 """
 
 from psychopy import visual, core, event, monitors, tools
+import numpy as np
 
 # Set monitor properties
 PIXELS_MONITOR = [1280, 800]
@@ -28,20 +29,15 @@ rows = 5      # Number of horizontal divisions
 cols = 6      # Number of vertical divisions
 spacing = 150  # Spacing between lines
 
-# Create the grid using rectangles (acting as the lines)
-rectangles = []
-
-# Create vertical rectangles (acting as vertical lines)
-for col in range(cols):
-    x_pos = (col - (cols // 2)) * spacing  # Calculate x position for each vertical rectangle
-    rect = visual.Rect(win, width=5, height=800, fillColor="black", lineColor="black", pos=(x_pos, 0))
-    rectangles.append(rect)
-
-# Create horizontal rectangles (acting as horizontal lines)
-for row in range(rows):
-    y_pos = (row - (rows // 2)) * spacing  # Calculate y position for each horizontal rectangle
-    rect = visual.Rect(win, width=800, height=5, fillColor="black", lineColor="black", pos=(0, y_pos))
-    rectangles.append(rect)
+# Create the grid as a single ElementArrayStim (one draw call for all lines):
+# vertical lines are 5 x 800 px rectangles, horizontal lines 800 x 5 px
+x_pos = (np.arange(cols) - (cols // 2)) * spacing  # x position of each vertical line
+y_pos = (np.arange(rows) - (rows // 2)) * spacing  # y position of each horizontal line
+xys = np.concatenate([np.column_stack([x_pos, np.zeros(cols)]),
+                      np.column_stack([np.zeros(rows), y_pos])])
+sizes = np.concatenate([np.tile([5, 800], (cols, 1)), np.tile([800, 5], (rows, 1))])
+grid = visual.ElementArrayStim(win, units='pix', nElements=cols + rows, xys=xys, sizes=sizes,
+                               elementTex=None, elementMask=None, colors=(-1, -1, -1), colorSpace='rgb')
 
 cross_vert = visual.Rect(
     win=win,
@@ -77,8 +73,7 @@ center = visual.Rect(
 #     lineColor="red") # circle outline color (optional)
 
 # Draw and display the grid
-# for rect in rectangles:
-#     rect.draw()
+# grid.draw()
 
 center.draw()
 cross_vert.draw()
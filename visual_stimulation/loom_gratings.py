@@ -2,7 +2,7 @@
 """
 Description: This script controls a visual stimulation experiment designed to study the
 sensory responses of zebrafish larvae. It utilizes PsychoPy to present visual stimuli and
-PyFirmata to synchronize the experiment with 2-photon (2P) imaging acquisition via an
+pyserial to synchronize the experiment with 2-photon (2P) imaging acquisition via an
 Arduino board.
 
 The experiment consists of a series of visual stimuli, including:
@@ -29,10 +29,11 @@ subsequent analysis.
 Created on 2024-11-11
 """
 from psychopy import visual, core, event, monitors, tools, gui, data
-from pyfirmata import Arduino
 import pandas as pd
+import numpy as np
 import datetime
 from pathlib import Path
+from utils import ACQ_PULSE, loom_radii, open_trigger_board
 
 #Set monitor properties
 PIXELS_MONITOR = [1280, 800]
@@ -94,8 +95,12 @@ SPEED_CM_SEC = 1  # Speed of the grating in cm per second
 # Parameters for the looming circle effect
 START_RADIUS_CM = 0.5  # Minimum radius in cm
 END_RADIUS_CM = 3.5  # Maximum radius in cm
-RADIUS_STEP = ((END_RADIUS_CM - START_RADIUS_CM) *
-               PIXEL_CM_RATIO / (LOOM_DURATION_SEC * FPS))  # Radius change per frame
+
+# Per-frame stimulus values, computed once so the render loops only index into them.
+# Grating phase: shifted by the speed per frame (frame * SPEED_CM_SEC/FPS) and wrapped to [0, 1)
+GRATING_PHASES = np.mod(-np.arange(GRATING_DURATION_SEC * FPS) * (SPEED_CM_SEC / FPS), 1.0).tolist()
+# Looming radius in pixels (window units), growing every frame up to END_RADIUS_CM
+LOOM_RADII = loom_radii(START_RADIUS_CM, END_RADIUS_CM, LOOM_DURATION_SEC, FPS, PIXEL_CM_RATIO)
 
 # Initialize the window for visual stimulus
 win = visual.Window(
@@ -124,74 +129,75 @@ looming_circle = visual.Circle(
 )
 
 # Initialize Arduino connection
-BOARD = Arduino('COM3')  # Set the Arduino board COM port
-TRIGGER_PIN = 11  # Pin number to trigger stimulus
-pin = BOARD.get_pin(f'd:{TRIGGER_PIN}:o')  # Output pin to control stimulus trigger
+# The board runs trigger_pulse/trigger_pulse.ino: each trigger is a single serial byte
+# and the pulse itself is timed on the board
+board = open_trigger_board()
+
+def hold_blank(duration_sec):
+    """Hold the blank screen for duration_sec: one flip, then wait instead of flipping every frame."""
+    win.flip()
+    core.wait(duration_sec, hogCPUperiod=0.2)
 
 # Time and event logging
-event_log = []  # List to store event logs
+# Event names and their timestamps in two parallel lists; the log table is built at the end
+events, timestamps = [], []
 timer = core.Clock()  # Timer to track time during the experiment
 
 # Log the start of the experiment
-event_log.append({'fish_ID': metadata_dict["fish_ID"],'event': 'trigger_start_exp', 'timestamp': timer.getTime()})
-pin.write(1)  # Send a trigger signal to Arduino to mark the start
+timestamps.append(timer.getTime())
+events.append('trigger_start_exp')
+board.write(ACQ_PULSE)  # Send a trigger signal to Arduino to mark the start
 print("Experiment started and trigger sent")
 
 # # # Start the spontaneous activity blank screen
-for frame in range(FPS * SPONTANEOUS_ACTIVITY_SEC):
-    remaining_time = SPONTANEOUS_ACTIVITY_SEC - timer.getTime()
-    win.flip()  # Update the window
+hold_blank(SPONTANEOUS_ACTIVITY_SEC)
 
 # Start the stimuli cycles
 for cycle in range(N_CYCLES):
     print(f"Starting stimulus cycle {cycle + 1}...")
-    event_log.append({'fish_ID': metadata_dict["fish_ID"], 'event': f'gratings_{cycle}', 'timestamp': timer.getTime()})
+    timestamps.append(timer.getTime())
+    events.append(f'gratings_{cycle}')
     print(f"Starting gratings")
-    for frame in range(GRATING_DURATION_SEC * FPS):  # Loop through each frame in the total duration
-        # Update the grating's phase (position of the pattern) based on the speed
-        # The phase is incremented by the speed of the grating per frame (frame * SPEED_CM_SEC/FPS)
-        # and wrapped around (using modulus 1) to prevent it from exceeding the range [0, 1]
-        grating.phase = - (frame * SPEED_CM_SEC / FPS) % 1
+    for phase in GRATING_PHASES:  # One precomputed phase per frame
+        grating.phase = phase
         grating.draw()
         win.flip()
 
     # Log the start of the stimulus cycle
-    event_log.append({'fish_ID': metadata_dict["fish_ID"],'event': f'loom_{cycle}', 'timestamp': timer.getTime()})
-    #pin.write(1)  # Trigger stimulus on Arduino
-    looming_circle.radius = START_RADIUS_CM
+    timestamps.append(timer.getTime())
+    events.append(f'loom_{cycle}')
+    #board.write(AUX_HIGH)  # Trigger stimulus on Arduino
     print(f"Starting looming")
 
     # Create the looming effect by increasing the circle's radius
-    for frame in range(FPS * LOOM_DURATION_SEC):
-        looming_circle.radius += RADIUS_STEP  # Increase radius per frame
+    for radius in LOOM_RADII:
+        looming_circle.radius = radius
         looming_circle.draw()  # Draw the circle on the screen
         win.flip()  # Update the window with the drawn circle
 
     # Log the inter-stimulus delay
-    #pin.write(0)  # Turn off stimulus on Arduino
-    event_log.append({'fish_ID': metadata_dict["fish_ID"],'event': f'interstim_pause_{cycle}', 'timestamp': timer.getTime()})
+    #board.write(AUX_LOW)  # Turn off stimulus on Arduino
+    timestamps.append(timer.getTime())
+    events.append(f'interstim_pause_{cycle}')
     print(f"Starting pause")
-    for frame in range(FPS * INTER_STIMULUS_SEC):
-        win.flip()  # Update the window
+    hold_blank(INTER_STIMULUS_SEC)
 
-for frame in range(FPS * END_EXP_SEC):
-    win.flip()  # Update the window
+hold_blank(END_EXP_SEC)
 
 # Log the end of the experiment
-event_log.append({'fish_ID': metadata_dict["fish_ID"],'event': 'end_exp', 'timestamp': timer.getTime()})
+timestamps.append(timer.getTime())
+events.append('end_exp')
 print("Experiment ended")
+board.close()
 win.close()  # Close the PsychoPy window
 
 # Save the event log to a CSV file
 current_date = datetime.datetime.now().strftime("%Y-%m-%d-%H%M")
-df_timestamps = pd.DataFrame(event_log)
+df_timestamps = pd.DataFrame({'fish_ID': metadata_dict["fish_ID"], 'event': events, 'timestamp': timestamps})
 timestamps_filename = current_date + f'_fish{metadata_dict["fish_ID"]}_timestamps.csv'
 df_timestamps.to_csv(exp_path / timestamps_filename, index=None)
 
 #Save experiment metadata
 metadata_filename = current_date + f'_fish{metadata_dict["fish_ID"]}_metadata.csv'
-metadata_df = pd.DataFrame([metadata_dict])
-exp_param_df = pd.DataFrame([experiment_params])
-
-exp_data_df = pd.concat([metadata_df, exp_param_df], axis=1)
+exp_data_df = pd.DataFrame([{**metadata_dict, **experiment_params}])  # one row: metadata then parameters
 exp_data_df.to_csv(exp_path / metadata_filename, index=False)
\ No newline at end of file
@@ -8,37 +8,40 @@ import matplotlib.pyplot as plt
 tif_path = r'C:\Users\zebrafish\code\2p_visual_stimulation\data'
 filename = tif_path + ('\synchro_2_DynamicDots_00002.tif')
 n_channels = 2
-metadata_all = {}
+AUX_RE = re.compile(r"auxTrigger(\d+) = \[(.*?)\]", re.DOTALL)  # all triggers in one scan
 
 with ScanImageTiffReader(filename) as tif:
+    # All frame descriptions in one pass (bulk call where the reader provides one), parsed below
+    if hasattr(tif, 'descriptions'):
+        descriptions = tif.descriptions()
+    else:
+        descriptions = [tif.description(i) for i in range(len(tif))]
+
+n_frames = len(descriptions)
+# Columnar storage per trigger: which frames carry trigger data, and the first value (timestamp)
+has_trigger = np.zeros((n_channels, n_frames), dtype=bool)
+first_value = np.empty((n_channels, n_frames), dtype=np.float64)
+for i, metadata in enumerate(descriptions):  # Full metadata of frame i
+    found = [False] * n_channels
+    for trigger_str, aux_trigger_data in AUX_RE.findall(metadata):
+        trigger = int(trigger_str)
+        if trigger >= n_channels or found[trigger]:
+            continue  # other channels, or a repeated entry (the first one counts)
+        found[trigger] = True
+        if aux_trigger_data:
+            has_trigger[trigger, i] = True
+            first_value[trigger, i] = float(aux_trigger_data.split(',', 1)[0])
     for trigger in range(n_channels):
-        metadata_all[f'auxTrigger{trigger}'] = {}
-        for i in range(len(tif)):
-            #print(f"Reading frame {idx}...")
-            metadata = tif.description(i)  # Full metadata
-            aux_trigger_match = re.search(rf"auxTrigger{trigger} = \[(.*?)\]", metadata, re.DOTALL)
-            if aux_trigger_match:
-                aux_trigger_data = aux_trigger_match.group(1)
-                if aux_trigger_data:
-                    aux_trigger_values = np.fromstring(aux_trigger_data, sep=',')
-                    metadata_all[f'auxTrigger{trigger}'][f'frame{i}'] = aux_trigger_values
-                else:
-                    pass
-            else:
-                print(f"aux_trigger_match{trigger} not found in frame {i}")
+        if not found[trigger]:
+            print(f"aux_trigger_match{trigger} not found in frame {i}")
 
 data_sync = {}
-for i, auxTrigger in enumerate(metadata_all.keys()):
-    data_sync[auxTrigger] = {}
-    frame_numbers = sorted([int(key.replace('frame', '')) for key in metadata_all[auxTrigger].keys()])
-    # Identify the start of each consecutive block
-    start_frames = []
-    for i, frame in enumerate(frame_numbers):
-        if i == 0 or frame != frame_numbers[i-1] + 1:
-            start_frames.append(frame)
-    timestamps = [metadata_all[auxTrigger][f'frame{frame}'][0] for frame in start_frames]
-    data_sync[auxTrigger]['start_frames'] = start_frames
-    data_sync[auxTrigger]['timestamps'] = timestamps
+for trigger in range(n_channels):
+    frame_numbers = np.flatnonzero(has_trigger[trigger])
+    # Start of each consecutive block: frames not directly preceded by another trigger frame
+    start_frames = frame_numbers[np.diff(frame_numbers, prepend=-2) != 1]
+    data_sync[f'auxTrigger{trigger}'] = {'start_frames': start_frames,
+                                        'timestamps': first_value[trigger, start_frames]}
 
 # Step 3: Compute the difference in timestamps between auxTrigger1 and auxTrigger2
 timestamps1 = data_sync['auxTrigger0']['timestamps']
@@ -50,7 +53,7 @@ timestamps1 = timestamps1[:min_length]
 timestamps2 = timestamps2[:min_length]
 
 # Compute differences
-time_differences = abs(np.array(timestamps1) - np.array(timestamps2))
+time_differences = np.abs(timestamps1 - timestamps2)
 
 # # Step 4: Plot the timestamp differences
 plt.figure(figsize=(10, 6))
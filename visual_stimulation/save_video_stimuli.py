@@ -1,7 +1,9 @@
 import time
-from psychopy import visual, core, event, monitors, tools, filters
+from psychopy import visual, event, monitors, tools, filters
 from pathlib import Path
 import numpy as np
+import imageio
+from utils import loom_radii
 
 #Set monitor properties
 PIXELS_MONITOR = [1920, 1080]
@@ -24,8 +26,12 @@ SPEED_CM_SEC = 1  # Speed of the grating in cm per second
 # Parameters for the looming circle effect
 START_RADIUS_CM = 0.5  # Minimum radius in cm
 END_RADIUS_CM = 3.5  # Maximum radius in cm
-RADIUS_STEP = ((END_RADIUS_CM - START_RADIUS_CM) *
-               PIXEL_CM_RATIO / (LOOM_DURATION_SEC * FPS))  # Radius change per frame
+
+# Per-frame stimulus values, computed once so the render loops only index into them.
+# Grating phase: shifted by the speed per frame (frame * SPEED_CM_SEC/FPS) and wrapped to [0, 1)
+GRATING_PHASES = np.mod(-np.arange(GRATING_DURATION_SEC * FPS) * (SPEED_CM_SEC / FPS), 1.0).tolist()
+# Looming radius in pixels (window units), growing every frame up to END_RADIUS_CM
+LOOM_RADII = loom_radii(START_RADIUS_CM, END_RADIUS_CM, LOOM_DURATION_SEC, FPS, PIXEL_CM_RATIO)
 
 grating_res = 800  # Resolution of the grating texture
 
@@ -65,36 +71,56 @@ looming_circle = visual.Circle(
     fillColor="red",  # circle color
     lineColor="red"  # circle outline color (optional)
 )
-timer = core.Clock()
+# Frames are appended to the video as they are captured instead of being kept in
+# win.movieFrames until the end of the run and encoded in one pass
+video_writer = imageio.get_writer('stimuli_2p_gratings_loom.mp4', fps=180, codec='mpeg4')
+
+def capture_frame():
+    """Return the frame just flipped as an array."""
+    frame = np.asarray(win.getMovieFrame(buffer='front'))
+    win.movieFrames.pop()  # getMovieFrame also stores every frame on the window
+    return frame
+
+def record_frame():
+    """Capture the frame just flipped and append it to the video."""
+    video_writer.append_data(capture_frame())
+
+# Blank periods, as a fixed number of frames computed once; the recorded length does not
+# depend on how fast frames happen to be captured
+N_SPONTANEOUS_FRAMES = int(round(SPONTANEOUS_ACTIVITY_SEC * FPS))
+N_INTER_STIMULUS_FRAMES = int(round(INTER_STIMULUS_SEC * FPS))
+
+# Every blank frame is identical: capture it once and append it instead of flipping
+# and reading back the window for each of them
+win.flip()
+BLANK_FRAME = capture_frame()
+
+def record_blank(n_frames):
+    """Append n_frames blank frames to the video."""
+    for _ in range(n_frames):
+        video_writer.append_data(BLANK_FRAME)
+
 # # # Start the spontaneous activity blank screen
-while timer.getTime() <= SPONTANEOUS_ACTIVITY_SEC:
-    win.flip()  # Update the window
-    win.getMovieFrame(buffer='front')
+record_blank(N_SPONTANEOUS_FRAMES)
 
 # Start the stimuli cycles
 for cycle in range(N_CYCLES):
-    for frame in range(GRATING_DURATION_SEC * FPS):  # Loop through each frame in the total duration
-        # Update the grating's phase (position of the pattern) based on the speed
-        # The phase is incremented by the speed of the grating per frame (frame * SPEED_CM_SEC/FPS)
-        # and wrapped around (using modulus 1) to prevent it from exceeding the range [0, 1]
-        grating.phase = - (frame * SPEED_CM_SEC / FPS) % 1
+    for phase in GRATING_PHASES:  # One precomputed phase per frame
+        grating.phase = phase
         grating.draw()
         win.flip()
-        win.getMovieFrame(buffer='front')
+        record_frame()
 
-    looming_circle.radius = START_RADIUS_CM
     # Create the looming effect by increasing the circle's radius
-    for frame in range(FPS * LOOM_DURATION_SEC):
-        looming_circle.radius += RADIUS_STEP  # Increase radius per frame
+    for radius in LOOM_RADII:
+        looming_circle.radius = radius
         looming_circle.draw()  # Draw the circle on the screen
         win.flip()  # Update the window with the drawn circle
-        win.getMovieFrame(buffer='front')
+        record_frame()
 
-    # Log the inter-stimulus delay
-    for frame in range(FPS * INTER_STIMULUS_SEC):
-        win.flip()  # Update the window
-        win.getMovieFrame(buffer='front')
+    # Inter-stimulus blank screen
+    record_blank(N_INTER_STIMULUS_FRAMES)
 
 video_path = Path(r'C:\Users\zebrafish\code\2p_visual_stimulation\video_stimuli')
 win.close()
-win.saveMovieFrames('stimuli_2p_gratings_loom.mp4', fps=180, codec='mpeg4')
\ No newline at end of file
+video_writer.close()
\ No newline at end of file
@@ -4,10 +4,11 @@ Created on 2024-12-20
 """
 
 from psychopy import visual, core, event, monitors, tools
-from pyfirmata import Arduino
 import pandas as pd
+import numpy as np
 import datetime
 from pathlib import Path
+from utils import SYNC_HIGH, SYNC_LOW, load_stimulus, open_trigger_board
 
 #Set monitor properties
 PIXELS_MONITOR = [1280, 800]
@@ -26,6 +27,7 @@ STIMULUS_sec = 3
 N_CYCLES = 10
 N_DOTS = 10
 SIZE = 0.3
+N_STIMULUS_FRAMES = FPS * STIMULUS_sec
 
 # Initialize the window for visual stimulus
 win = visual.Window(
@@ -43,53 +45,61 @@ circle = visual.Circle(
     fillColor="red",  # circle color
     lineColor="red") # circle outline color (optional)
 
-group_dots = [visual.Circle(win, size=SIZE, fillColor='red', pos=[0, 0], units='cm') for _ in range(N_DOTS)]
-dots_positions_df = pd.read_csv(STIMULI_PATH)
+# All dots drawn with a single ElementArrayStim call (sizes are diameters, like Circle size)
+group_dots = visual.ElementArrayStim(win=win, nElements=N_DOTS, xys=np.zeros((N_DOTS, 2)), sizes=SIZE,
+                                     elementTex=None, elementMask="circle", colors=(1, -1, -1), colorSpace="rgb",
+                                     units='cm', autoLog=False)
+dots_positions = load_stimulus(STIMULI_PATH, fields=("x", "y"))  # (n_frames, n_dots, 2)
 
 # Initialize Arduino connection
-BOARD = Arduino('COM3')  # Set the Arduino board COM port
-TRIGGER_PIN = 12  # Pin number to trigger stimulus
-pin = BOARD.get_pin(f'd:{TRIGGER_PIN}:o')  # Output pin to control stimulus trigger
+# The board runs trigger_pulse/trigger_pulse.ino: each command is a single serial byte;
+# the synchronization signal (SYNC_HIGH/SYNC_LOW) is on pin 12
+board = open_trigger_board()
 
 # Time and event logging
-event_log = []  # List to store event logs
+# Event names and their timestamps in two parallel lists; the log table is built at the end
+events, timestamps = [], []
 timer = core.Clock()  # Timer to track time during the experiment
-pin.write(1)  # Send a trigger signal to Arduino to mark the start
+board.write(SYNC_HIGH)  # Send a trigger signal to Arduino to mark the start
 
 # Log the start of the experiment
-event_log.append({'event': 'trigger_start_exp', 'timestamp': timer.getTime()})
+timestamps.append(timer.getTime())
+events.append('trigger_start_exp')
 print("Experiment started and trigger sent")
-pin.write(0)
+board.write(SYNC_LOW)
 
 for cycle in range(N_CYCLES):
     print(f"Starting stimulus cycle {cycle + 1}...")
     print(f"BACKGROUND")
-    event_log.append({'event': f'background_{cycle}', 'timestamp': timer.getTime()})
+    timestamps.append(timer.getTime())
+    events.append(f'background_{cycle}')
 
-    for frame in range(FPS * BACKGROUND_sec):
-        win.flip()
+    # Blank background: nothing changes on screen, so flip once and wait
+    win.flip()
+    core.wait(BACKGROUND_sec, hogCPUperiod=0.2)
 
     print(f"CIRCLE")
-    pin.write(1)
-    event_log.append({'event': f'dots_{cycle}', 'timestamp': timer.getTime()})
-
-    for frame in range(FPS * STIMULUS_sec):
-        for i in range(N_DOTS):
-            value = dots_positions_df[f'dot{i}_x'][frame], dots_positions_df[f'dot{i}_y'][frame]
-            group_dots[i].pos = value
-            group_dots[i].draw()
+    board.write(SYNC_HIGH)
+    timestamps.append(timer.getTime())
+    events.append(f'dots_{cycle}')
+
+    for frame in range(N_STIMULUS_FRAMES):
+        group_dots.xys = dots_positions[frame, :N_DOTS]
+        group_dots.draw()
         win.flip()
-    pin.write(0)
+    board.write(SYNC_LOW)
 
 # Log the end of the experiment
-pin.write(1)
-event_log.append({'event': 'end_exp', 'timestamp': timer.getTime()})
-pin.write(0)  # Send a trigger signal to Arduino to mark the end
+board.write(SYNC_HIGH)
+timestamps.append(timer.getTime())
+events.append('end_exp')
+board.write(SYNC_LOW)  # Send a trigger signal to Arduino to mark the end
 print("Experiment ended")
+board.close()
 win.close()  # Close the PsychoPy window
 
 # Save the event log to a CSV file
-df_timestamps = pd.DataFrame(event_log)
+df_timestamps = pd.DataFrame({'event': events, 'timestamp': timestamps})
 current_date = datetime.datetime.now()
 filename = current_date.strftime("%Y-%m-%d-%H%M") + f'_synchro_DynamicDots.csv'
 df_timestamps.to_csv(CSV_PATH / filename, index=None)
\ No newline at end of file
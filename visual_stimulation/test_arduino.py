@@ -1,36 +1,31 @@
 # -*- coding: utf-8 -*-
 """
 Description: This script to test communication with an Arduino Board
+running trigger_pulse/trigger_pulse.ino
 
 @author: Matilde Perrino
 Created on 2024-11-11
 """
 
 import time
-from pyfirmata import Arduino, util
+from utils import AUX_HIGH, AUX_LOW, TRIGGER_PORT, open_trigger_board
 
-PIN = 13
-# Specify the COM port where your Arduino is connected (COM3 in this case)
-board = Arduino('COM3')
+PIN = 13  # auxiliary trigger pin of trigger_pulse.ino
+# Connect to the Arduino on TRIGGER_PORT (COM3) and wait until it reports ready
+board = open_trigger_board(TRIGGER_PORT)
 
-# Give the board some time to initialize
-time.sleep(2)
-
-# Set pin 12 as an OUTPUT
-pin = board.get_pin(f'd:{PIN}:o')
-
-pin.write(0)
+board.write(AUX_LOW)
 
 # Turn the pin ON (HIGH)
-pin.write(1)
-print(f"Pin {PIN} is ON for 15 seconds")
+board.write(AUX_HIGH)
+print(f"Pin {PIN} is ON for 3 seconds")
 
-# Wait for 5 seconds
+# Wait for 3 seconds
 time.sleep(3)
 
 # Turn the pin OFF (LOW)
-pin.write(0)
+board.write(AUX_LOW)
 print(f"Pin {PIN} is OFF")
 
 # Close the connection to the board
-board.exit()
\ No newline at end of file
+board.close()
@@ -0,0 +1,49 @@
+// Serial trigger firmware for the visual stimulation scripts (replaces StandardFirmata).
+// One byte per command, so each trigger is a single serial write from Python and
+// the pulse width is timed on the board:
+//   'P' -> pulse the acquisition trigger pin (ACQ_PIN) for PULSE_US microseconds
+//   'H' -> set the auxiliary trigger pin (AUX_PIN) high (stimulus on)
+//   'L' -> set the auxiliary trigger pin low (stimulus off)
+//   'S' -> set the synchronization pin (SYNC_PIN) high
+//   's' -> set the synchronization pin low
+// After a (re)connect the board resets and sends 'R' once it is ready.
+
+const int ACQ_PIN = 11;
+const int AUX_PIN = 13;
+const int SYNC_PIN = 12;
+const unsigned int PULSE_US = 100;
+
+void setup() {
+  pinMode(ACQ_PIN, OUTPUT);
+  pinMode(AUX_PIN, OUTPUT);
+  pinMode(SYNC_PIN, OUTPUT);
+  digitalWrite(ACQ_PIN, LOW);
+  digitalWrite(AUX_PIN, LOW);
+  digitalWrite(SYNC_PIN, LOW);
+  Serial.begin(115200);
+  Serial.write('R');
+}
+
+void loop() {
+  if (Serial.available() > 0) {
+    switch (Serial.read()) {
+      case 'P':
+        digitalWrite(ACQ_PIN, HIGH);
+        delayMicroseconds(PULSE_US);
+        digitalWrite(ACQ_PIN, LOW);
+        break;
+      case 'H':
+        digitalWrite(AUX_PIN, HIGH);
+        break;
+      case 'L':
+        digitalWrite(AUX_PIN, LOW);
+        break;
+      case 'S':
+        digitalWrite(SYNC_PIN, HIGH);
+        break;
+      case 's':
+        digitalWrite(SYNC_PIN, LOW);
+        break;
+    }
+  }
+}
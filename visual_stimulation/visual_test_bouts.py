@@ -10,8 +10,9 @@ Created on: 2025-07-11
 """
 
 from psychopy import visual, core, monitors, tools, gui
-import pandas as pd
+import numpy as np
 from pathlib import Path
+from utils import load_stimulus
 
 # Ask user for parameters
 dlg = gui.Dlg(title="Stimulus Test Setup")
@@ -35,7 +36,9 @@ flip_coordinates = (fish_orientation == "bottom-left")
 # Load first 3 stimuli CSVs
 stimuli_dir = Path(r"Z:\FAC\FBM\CIG\jlarsch\default\D2c\Matilde\2p\stimuli_bout_2p")
 stimuli_files = sorted(stimuli_dir.glob("*.csv"))[:3]
-stimuli = {f.stem: pd.read_csv(f) for f in stimuli_files}
+# Positions of at most max_dots dots, with the orientation flip applied once here
+sign = -1.0 if flip_coordinates else 1.0
+stimuli = {f.stem: sign * load_stimulus(f, fields=("x", "y"))[:, :max_dots] for f in stimuli_files}
 
 # Monitor and window setup
 PIXELS_MONITOR = [1280, 800]
@@ -47,34 +50,34 @@ FPS = 60
 
 win = visual.Window(size=PIXELS_MONITOR, units="pix", fullscr=True, color="red", monitor=monitor, screen=1)
 
-# Create reusable dot objects
-dots = [visual.Circle(win, radius=dot_radius_cm, fillColor="black", units="cm") for _ in range(max_dots)]
+# One ElementArrayStim per dot count: all dots of a frame are drawn with a single call
+dot_fields = {
+    n_dots: visual.ElementArrayStim(win=win, nElements=n_dots, xys=np.zeros((n_dots, 2)), sizes=2 * dot_radius_cm,
+                                    elementTex=None, elementMask="circle", colors=(-1, -1, -1), colorSpace="rgb",
+                                    units="cm", autoLog=False)
+    for n_dots in {stim_frames.shape[1] for stim_frames in stimuli.values()}
+}
 
 # Run all stimuli for the specified number of repetitions
 for rep in range(n_reps):
-    for name, df in stimuli.items():
-        n_dots = len(df.columns) // 2
-        n_frames = len(df)
+    for name, stim_frames in stimuli.items():
+        n_frames, n_dots = stim_frames.shape[:2]
+        dot_field = dot_fields[n_dots]
 
         # Pre-stimulus pause
-        for _ in range(int(pre_pause * FPS)):
-            win.flip()
+        win.flip()
+        core.wait(pre_pause, hogCPUperiod=0.2)
 
         # Stimulus presentation
         print(f"Showing {name.split('_')[0]}")
         for frame in range(n_frames):
-            for d in range(n_dots):
-                x = df[f'dot{d}_x'][frame]
-                y = df[f'dot{d}_y'][frame]
-                if flip_coordinates:
-                    x, y = -x, -y
-                dots[d].pos = (x, y)
-                dots[d].draw()
+            dot_field.xys = stim_frames[frame]
+            dot_field.draw()
             win.flip()
 
         # Post-stimulus pause
-        for _ in range(int(post_pause * FPS)):
-            win.flip()
+        win.flip()
+        core.wait(post_pause, hogCPUperiod=0.2)
 
 # Close window when done
 win.close()